@@ -8,44 +8,46 @@ import copy as cp
 from Track import Track
 import matplotlib.pyplot as plt
 
-def fileImport(fileName): # brings file into program as str numpy array
-    inputText = ''
-    with open(fileName, "r") as f:
-        inputText = f.read()
-    print(inputText)
-    textRows = inputText.split('\n')
-    dimTxt = textRows[0].split(',')
-
-    numRows = int(dimTxt[0])
-    numCols = int(dimTxt[1])
-
-    inputTextArray = np.zeros((numRows, numCols), dtype = str)
-
-    for row in range(numRows):
-        # currentRow = textRows[row + 1].split()
-        for col in range(numCols):
-            inputTextArray[row][col] = textRows[row + 1][col]
-            
-    # print(inputTextArray)
-    
-    return inputTextArray
-
-def createTrack(inputTextArray, CRASH_POS):
-    rows = inputTextArray.shape[0]
-    cols = inputTextArray.shape[1]
+# track integer of every byte of a track file: 1 is 'S' aka Start, 2 is 'F' aka Finish, 3 is '#', or wall,
+# anything else (normally '.') is 0 aka track
+TRACK_CODES = np.zeros(256, dtype = np.uint8)
+TRACK_CODES[ord('S')] = 1
+TRACK_CODES[ord('F')] = 2
+TRACK_CODES[ord('#')] = 3
+
+def fileImport(fileName, echo = True): # brings file into program as str numpy array
+    # the file is read as bytes and the grid cut out with numpy, so large tracks load without per-cell python work.
+    # echo prints the file like before. Raises ValueError when the grid is smaller than its "rows,cols" header.
+    with open(fileName, "rb") as f:
+        inputBytes = f.read()
+    if echo:
+        print(inputBytes.decode())
+    header, _, body = inputBytes.partition(b'\n')
+    try:
+        numRows, numCols = (int(dim) for dim in header.split(b','))
+    except ValueError:
+        raise ValueError(fileName + ": header should be 'rows,cols', got " + repr(header.decode().strip()))
+
+    body = np.frombuffer(body, dtype = np.uint8)
+    body = body[body != ord('\r')] # windows line endings
+    if (body.size >= numRows * (numCols + 1) - 1) and (body[numCols::numCols + 1][:numRows - 1] == ord('\n')).all():
+        # every row is exactly numCols long: one reshape
+        body = np.append(body[:numRows * (numCols + 1) - 1], np.uint8(ord('\n')))
+        grid = body.reshape(-1, numCols + 1)[:numRows, :numCols]
+    else:
+        # rows with trailing characters (ignored like before), checked row by row
+        textRows = bytes(body).split(b'\n')
+        if (len(textRows) < numRows) or any(len(textRow) < numCols for textRow in textRows[:numRows]):
+            raise ValueError(fileName + ": grid is smaller than its header (" + str(numRows) + "," + str(numCols) + ")")
+        grid = np.frombuffer(b''.join(textRow[:numCols] for textRow in textRows[:numRows]), dtype = np.uint8).reshape(numRows, numCols)
 
-    trackIntegers = np.zeros((rows, cols), dtype = int)
+    inputTextArray = grid.astype(np.uint32).view('<U1') # same str array as before, one character per cell (written as code points)
+    return inputTextArray
 
+def createTrack(inputTextArray, CRASH_POS, valueDtype = float, scratchDir = None, cacheDir = None):
     # 1 is 'S' aka Start, 2 is 'F' aka Finish, 0 is '.' aka track, 3 is '#', or wall. 
-    for row in range(rows):
-        for col in range(cols):
-            character = inputTextArray[row][col]
-            if (character == 'S'):
-                trackIntegers[row][col] = 1
-            if (character == 'F'):
-                trackIntegers[row][col] = 2
-            if (character == '#'):
-                trackIntegers[row][col] = 3
+    # looked up by code point, read straight from the str array's memory (anything past 255 is track like '.')
+    trackIntegers = TRACK_CODES[np.minimum(np.ascontiguousarray(inputTextArray, dtype = '<U1').view(np.uint32), 255)]
 
     crashReset = False
 
@@ -54,7 +56,7 @@ def createTrack(inputTextArray, CRASH_POS):
     elif (CRASH_POS != 'NRST'):
         print("CRASH_POS invalid, defaulting to NRST setting (nearest non-crash position)")
         
-    track = Track(trackIntegers , crashReset, inputTextArray)
+    track = Track(trackIntegers , crashReset, inputTextArray, valueDtype, scratchDir, cacheDir = cacheDir)
     
     return track
 
@@ -128,35 +130,126 @@ def saveOutput(GROUP_ID, ALGORITHM, TRACK_NAME, CRASH_POS, track):
     plt.close(fig)
     return
 
-def main(GROUP_ID, ALGORITHM, TRACK_NAME, CRASH_POS): 
-
-    inputTextArray = fileImport(TRACK_NAME)
-    track = createTrack(inputTextArray, CRASH_POS)
+def main(GROUP_ID, ALGORITHM, TRACK_NAME, CRASH_POS, BACKUP = 'loop', EPSILON = 0.0, POLICY_PATIENCE = None, PRUNE = False,
+         FLOAT32 = False, SCRATCH_DIR = None, COARSEN = None, INCREMENTAL_DIR = None, CACHE_DIR = None, ECHO = True,
+         KERNEL = 'loop', SEED = None, LEARNERS = 1, COMBINE = 'best',
+         HOGWILD = False, REPLAY = None): 
+    # BACKUP only applies to ValItr: 'loop', 'vector' (numpy backups, same result), 'sparse' (expected-value backups),
+    # 'gaussSeidel' or 'prioritized' (in-place expected-value backups, finish line outward), 'parallel'
+    # (expected-value backups split across every core) or 'blocked' (expected-value backups a block at a time)
+    # EPSILON stops value iteration once no value changes by more than it in a sweep
+    # POLICY_PATIENCE stops value iteration once the greedy policy has not changed for that many sweeps in a row
+    # PRUNE solves only states reachable from the start that can still finish (not for 'loop' / 'vector')
+    # FLOAT32 stores ValItr / PolItr values as float32 instead of float64
+    # SCRATCH_DIR keeps the big tables as memory mapped files in that folder (use with BACKUP = 'blocked')
+    # COARSEN (e.g. 2 or 4) first solves a that much coarser track and warm starts ValItr from it (with BACKUP 'loop' or
+    # 'vector', which cannot be warm started, it runs 'gaussSeidel', where the warm start saves the most sweeps)
+    # INCREMENTAL_DIR keeps the last ValItr solve of every track / crash mode there and only re-solves what an edit changed
+    # (with BACKUP 'loop' or 'vector', which cannot be warm started, it runs 'sparse')
+    # CRASH_POS 'BOTH' (ValItr only) solves NRST and STRT together and writes both results. It always uses the
+    # expected-value ('sparse') backup on every state, so BACKUP, POLICY_PATIENCE, PRUNE, COARSEN and INCREMENTAL_DIR
+    # are ignored
+    # CACHE_DIR keeps compiled transition tables there, so later runs on the same track / crash mode skip compiling them
+    # ECHO prints the track file as it is loaded
+    # KERNEL only applies to QLrng / SARSA: 'loop' (moves the car every step) or 'flat' (same training on the compiled
+    # transition tables, much faster)
+    # SEED makes QLrng / SARSA / RTDP runs repeatable (None: a fresh random run)
+    # LEARNERS > 1 runs that many seeded QLrng / SARSA learners in parallel processes (flat kernel) and keeps the
+    # shortest greedy path (COMBINE = 'best') or the path of their averaged Q tables (COMBINE = 'average', which keeps
+    # the best learner instead when the averaged path does not reach the finish line)
+    # HOGWILD makes the LEARNERS processes share out one run's episodes and train one shared Q table instead
+    # REPLAY only applies to QLrng: 'uniform' or 'prioritized' learns from minibatches of replayed moves (flat kernel)
+
+    inputTextArray = fileImport(TRACK_NAME, ECHO)
+    if (CRASH_POS == 'BOTH'):
+        # NRST and STRT solved in one shared pass, both results are written
+        if (ALGORITHM != 'ValItr'):
+            print("CRASH_POS BOTH is only available for ValItr. Terminating...")
+            sys.exit() # exit program
+        ignored = [name for name, isSet in (('BACKUP', BACKUP != 'loop'), ('POLICY_PATIENCE', POLICY_PATIENCE is not None),
+                                            ('PRUNE', PRUNE), ('COARSEN', COARSEN is not None),
+                                            ('INCREMENTAL_DIR', INCREMENTAL_DIR is not None)) if isSet]
+        if ignored:
+            print("CRASH_POS BOTH always runs the sparse backup on every state, ignoring " + ", ".join(ignored))
+        tracks = [createTrack(inputTextArray, crashPos, np.float32 if FLOAT32 else float, SCRATCH_DIR, CACHE_DIR) for crashPos in ('NRST', 'STRT')]
+        try: # scratch files are removed even if the solve fails
+            print("run Value Iteration (NRST and STRT together)")
+            tracks[0].doDualValueIteration(tracks[1], EPSILON)
+            for crashPos, track in zip(('NRST', 'STRT'), tracks):
+                print(crashPos + " Sweeps to Converge: " + str(track.getSweepCount()))
+                print(crashPos + " Moves of Best Run: " + str(track.getBestMoves()))
+                print(crashPos + " Operations to Find Solution: " + str(track.getOperations()))
+                saveOutput(GROUP_ID, ALGORITHM, TRACK_NAME, crashPos, track)
+        finally:
+            for track in tracks:
+                track.removeScratch()
+        return
+
+    track = createTrack(inputTextArray, CRASH_POS, np.float32 if FLOAT32 else float, SCRATCH_DIR, CACHE_DIR)
     
-    if (ALGORITHM == 'ValItr'):
-        # code to run variable elimination
-        # will be method on Network class
-        print("run Value Iteration")
-        track.doValueIteration()
+    try: # scratch files are removed even if the solve fails
+        if (ALGORITHM == 'ValItr'):
+            # code to run variable elimination
+            # will be method on Network class
+            print("run Value Iteration")
+            if (INCREMENTAL_DIR is not None) and (BACKUP in ('loop', 'vector')):
+                print("INCREMENTAL_DIR warm starts the solve, which BACKUP " + BACKUP + " cannot do, using 'sparse'")
+                BACKUP = 'sparse'
+            elif (COARSEN is not None) and (BACKUP in ('loop', 'vector')):
+                print("COARSEN warm starts the solve, which BACKUP " + BACKUP + " cannot do, using 'gaussSeidel'")
+                BACKUP = 'gaussSeidel'
+            if INCREMENTAL_DIR is not None:
+                solvePath = os.path.join(INCREMENTAL_DIR, TRACK_NAME.split('/')[-1][:-4] + "_" + CRASH_POS + ".npz")
+                track.doIncrementalValueIteration(solvePath, BACKUP, EPSILON, prune = PRUNE, policyPatience = POLICY_PATIENCE)
+            elif COARSEN is not None:
+                track.doMultigridValueIteration(COARSEN, BACKUP, EPSILON, prune = PRUNE, policyPatience = POLICY_PATIENCE)
+            else:
+                track.doValueIteration(BACKUP, EPSILON, policyPatience = POLICY_PATIENCE, prune = PRUNE)
+            print("Sweeps to Converge: " + str(track.getSweepCount()))
         
-    elif (ALGORITHM == 'QLrng'):
-        # code to run gibbs sampling
-        # will be method on Network class
-        print("run Q-Learning")
-        track.doQLearning()
-
-    elif (ALGORITHM == 'SARSA'):
-        # code to run gibbs sampling
-        # will be method on Network class
-        print("run State-Action-Reward-State-Action")
-        track.doSARSA()
+        elif (ALGORITHM == 'PolItr'):
+            print("run Policy Iteration")
+            track.doPolicyIteration(PRUNE)
+            print("Policy Evaluations: " + str(track.getSweepCount()))
+
+        elif (ALGORITHM == 'ShPath'):
+            print("run Shortest Path (deterministic, breadth first)")
+            track.doShortestPath()
+
+        elif (ALGORITHM == 'RTDP'):
+            print("run Real-Time Dynamic Programming")
+            track.doRTDP(seed = SEED)
+
+        elif (ALGORITHM == 'QLrng'):
+            # code to run gibbs sampling
+            # will be method on Network class
+            print("run Q-Learning")
+            if (LEARNERS > 1) and HOGWILD:
+                track.doHogwildLearning(False, LEARNERS, SEED)
+            elif (LEARNERS > 1):
+                track.doParallelLearning(False, LEARNERS, SEED, combine = COMBINE)
+            else:
+                track.doQLearning(KERNEL, SEED, REPLAY)
+
+        elif (ALGORITHM == 'SARSA'):
+            # code to run gibbs sampling
+            # will be method on Network class
+            print("run State-Action-Reward-State-Action")
+            if (LEARNERS > 1) and HOGWILD:
+                track.doHogwildLearning(True, LEARNERS, SEED)
+            elif (LEARNERS > 1):
+                track.doParallelLearning(True, LEARNERS, SEED, combine = COMBINE)
+            else:
+                track.doSARSA(KERNEL, SEED)
         
-    else:
-        print("Not a valid algorithm. Terminating...")
-        sys.exit() # exit program
+        else:
+            print("Not a valid algorithm. Terminating...")
+            sys.exit() # exit program
 
-    print("Moves of Best Run: " + str(track.getBestMoves()))
-    print("Operations to Find Solution: " + str(track.getOperations()))
+        print("Moves of Best Run: " + str(track.getBestMoves()))
+        print("Operations to Find Solution: " + str(track.getOperations()))
 
-    saveOutput(GROUP_ID, ALGORITHM, TRACK_NAME, CRASH_POS, track)
+        saveOutput(GROUP_ID, ALGORITHM, TRACK_NAME, CRASH_POS, track)
+    finally:
+        track.removeScratch()
     
\ No newline at end of file
@@ -0,0 +1,16 @@
+import numpy as np
+
+class RandomStream:
+    # ---------------- INSTANTIATION ------------------
+    def __init__(self, seed = None, blockSize = 65536):
+        # uniform [0, 1) numbers from a seeded numpy Generator, drawn blockSize at a time and handed out one by one as
+        # python floats, so per-step randomness costs about as much as a list read. The same seed gives the same stream.
+        self.generator = np.random.default_rng(seed)
+        self.blockSize = blockSize
+        self.uniform = self.generateUniforms().__next__ # next number of the stream: self.uniform()
+    # ---------------- END INSTANTIATION ------------------
+
+    def generateUniforms(self):
+        # refills lazily: a new block is only drawn once the last one is used up
+        while True:
+            yield from self.generator.random(self.blockSize).tolist()
@@ -0,0 +1,89 @@
+import numpy as np
+
+class ReplayBuffer:
+    # ---------------- INSTANTIATION ------------------
+    def __init__(self, capacity = 65536, prioritized = False, alpha = 0.6, beta = 0.4, seed = None):
+        # ring buffer of the last capacity transitions (state, action, reward, nextState, done) in numpy arrays, the
+        # oldest overwritten first. Minibatches are sampled uniformly, or with prioritized in proportion to
+        # priority ** alpha from a sum tree (priority is the last |TD error| of a transition, new ones get the highest
+        # seen so far), with importance weights (size * probability) ** -beta scaled to at most 1.
+        self.capacity = capacity
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.beta = beta
+        self.rng = np.random.default_rng(seed) # draws the minibatches
+
+        self.states = np.zeros(capacity, dtype = np.int64) # flat state, trackID * 121 + (vx + 5) * 11 + (vy + 5)
+        self.actions = np.zeros(capacity, dtype = np.int64) # action index, (ax + 1) * 3 + (ay + 1)
+        self.rewards = np.zeros(capacity)
+        self.nextStates = np.zeros(capacity, dtype = np.int64)
+        self.dones = np.zeros(capacity, dtype = bool) # True when the move reached the finish line
+        self.position = 0 # slot the next transition is written to
+        self.size = 0 # filled slots
+
+        # transitions are collected in a list and written to the arrays in one go (flush), so storing one costs a
+        # list append: self.add((state, action, reward, nextState, done))
+        self.pending = []
+        self.add = self.pending.append
+
+        # sum tree over the slots: node i holds the sum of nodes 2i and 2i + 1, slot k is leaf leaves + k, 1 is the root
+        self.leaves = 1 << max(capacity - 1, 1).bit_length()
+        self.tree = np.zeros(2 * self.leaves)
+        self.maxPriority = 1.0
+    # ---------------- END INSTANTIATION ------------------
+
+    def __len__(self):
+        return self.size + len(self.pending)
+
+    def flush(self):
+        # writes the collected transitions into the ring, new ones at the highest priority
+        if not self.pending:
+            return
+        newest = self.pending[-self.capacity:] # only the last capacity of them survive
+        self.pending.clear()
+        slots = (self.position + np.arange(len(newest))) % self.capacity
+        states, actions, rewards, nextStates, dones = zip(*newest)
+        self.states[slots] = states
+        self.actions[slots] = actions
+        self.rewards[slots] = rewards
+        self.nextStates[slots] = nextStates
+        self.dones[slots] = dones
+        self.position = (self.position + len(newest)) % self.capacity
+        self.size = min(self.size + len(newest), self.capacity)
+        if self.prioritized:
+            self.setPriorities(slots, np.full(len(newest), self.maxPriority))
+        return
+
+    def setPriorities(self, slots, priorities):
+        # new leaves, then the sums above them level by level up to the root
+        nodes = np.asarray(slots) + self.leaves
+        self.tree[nodes] = priorities ** self.alpha
+        while nodes[0] > 1:
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+        return
+
+    def updatePriorities(self, slots, tdErrors):
+        # priority of the sampled slots from their new TD errors (kept above 0 so every transition can come back)
+        priorities = np.abs(tdErrors) + 1e-6
+        self.maxPriority = max(self.maxPriority, float(priorities.max()))
+        self.setPriorities(slots, priorities)
+        return
+
+    def sample(self, batchSize):
+        # batchSize slots drawn with replacement and their importance weights (all 1 when uniform)
+        self.flush()
+        if not self.prioritized:
+            return self.rng.integers(self.size, size = batchSize), np.ones(batchSize)
+        # walk down the tree: go right whenever the target is past the left subtree's sum
+        targets = self.rng.random(batchSize) * self.tree[1]
+        nodes = np.ones(batchSize, dtype = np.int64)
+        while nodes[0] < self.leaves:
+            left = 2 * nodes
+            goRight = targets >= self.tree[left]
+            targets -= self.tree[left] * goRight
+            nodes = left + goRight
+        slots = np.minimum(nodes - self.leaves, self.size - 1) # rounding can land on an empty slot past the end
+        probabilities = self.tree[slots + self.leaves] / self.tree[1]
+        weights = (self.size * probabilities) ** -self.beta
+        return slots, weights / weights.max()
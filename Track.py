@@ -1,14 +1,95 @@
 import math
 import numpy as np
 import os
-import random 
 import sys
 import re
 import copy as cp
+import hashlib
+import shutil
+import tempfile
+import zipfile
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from RandomStream import RandomStream
+from ReplayBuffer import ReplayBuffer
+try:
+    import scipy.sparse as sparse # only needed for the sparse value iteration and policy iteration modes
+    import scipy.sparse.linalg as sparseLinalg
+except ImportError:
+    sparse = None
+    sparseLinalg = None
+
+# the stochastic race model of the planning solvers (expected-value value iteration, policy iteration, RTDP)
+DISCOUNT = 0.999 # the learners use their own discount (0.95)
+FAIL_PROBABILITY = 0.2 # chance an attempted acceleration is replaced by (0, 0), action index 4
+SUCCESS_PROBABILITY = 1 - FAIL_PROBABILITY
+NEVER_FINISH_VALUE = -1.0 / (1 - DISCOUNT) # value of a state that can never reach 'F': -1 every move, forever
+
+def expectedBackup(successValues, failValues):
+    # Q(s, a) = -1 + DISCOUNT * (0.8 * V(success) + 0.2 * V(failure)) for a move that does not start on 'F'.
+    # successValues is V where the move ends when its acceleration works, failValues V where it ends when it fails
+    # (either can be an array, they are broadcast together)
+    return -1.0 + DISCOUNT * (SUCCESS_PROBABILITY * successValues + FAIL_PROBABILITY * failValues)
+
+sharedTables = {} # tables a value iteration worker process has attached to, filled by attachSharedTables
+
+def attachSharedTables(specs):
+    # pool initializer for parallel value iteration: maps every shared memory block into this worker as a numpy array.
+    # specs is {name: (block name, shape, dtype)}
+    for name, (blockName, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name = blockName)
+        sharedTables[name + 'Block'] = block # keeps the mapping open
+        sharedTables[name] = np.ndarray(shape, dtype = dtype, buffer = block.buf)
+    return
+
+def sweepShard(start, end, readIndex):
+    # parallel value iteration task: expected-value backup of model states [start, end). Reads the previous sweep's
+    # values (buffer readIndex) and writes the new ones into the other buffer, so shards never touch each other's reads.
+    # Returns whether any value changed and the largest change in the shard's Q values (its Bellman residual)
+    values = sharedTables['values'][readIndex]
+    newValues = sharedTables['values'][1 - readIndex]
+    nextStates = sharedTables['nextStates'][start:end]
+    qValues = expectedBackup(values[nextStates], values[nextStates[:, 4]][:, None])
+    qValues[sharedTables['terminalStates'][start:end]] = 0.0
+    residual = float(np.max(np.abs(qValues - sharedTables['qTable'][start:end]))) if (end > start) else 0.0
+    newValues[start:end] = qValues.max(axis = 1)
+    sharedTables['qTable'][start:end] = qValues
+    return bool((newValues[start:end] != values[start:end]).any()), residual
+
+learnerTrack = None # Track a learner worker process trains on, set by attachLearnerTrack
+
+def attachLearnerTrack(track, specs = None):
+    # executor initializer for doParallelLearning / doHogwildLearning: keeps the Track (with its compiled tables) in
+    # this worker, and attaches the shared memory tables in specs (see attachSharedTables)
+    global learnerTrack
+    learnerTrack = track
+    if specs is not None:
+        attachSharedTables(specs)
+    return
+
+def trainLearner(sarsa, seed):
+    # doParallelLearning task: one seeded run of the flat kernel and its greedy evaluation.
+    # Returns (Q table, best path, best moves, training steps)
+    qTable = np.zeros((learnerTrack.trackSize * 121, 9))
+    randomStream = RandomStream(seed)
+    learnerTrack.opCount = 0
+    learnerTrack.trainQTable(qTable, sarsa = sarsa, randomStream = randomStream)
+    learnerTrack.evaluateQTable(qTable, randomStream = randomStream)
+    return qTable, learnerTrack.bestPath, learnerTrack.bestMoves, learnerTrack.opCount
+
+def trainHogwildShard(sarsa, seed, episodes, episodeNumber):
+    # doHogwildLearning task: the given episodes of an episodeNumber run, updating the shared Q table in place with
+    # no locks. Returns the training steps taken
+    learnerTrack.opCount = 0
+    learnerTrack.trainQTable(sharedTables['qVals'], sarsa = sarsa, episodeNumber = episodeNumber,
+                             randomStream = RandomStream(seed), episodes = episodes)
+    return learnerTrack.opCount
 
 class Track:
     # ---------------- INSTANTIATION ------------------
-    def __init__(self, track, crashReset, inputTextArray):
+    def __init__(self, track, crashReset, inputTextArray, valueDtype = float, scratchDir = None, blockSize = None,
+                 cacheDir = None, cacheBytes = 2**30):
         self.track = track # numpy array representing raw track grid
         self.trackShape = track.shape
         # 1 is 'S' aka Start, 2 is 'F' aka Finish, 0 is '.' aka track, 3 is '#', or wall. 
@@ -36,8 +117,9 @@ class Track:
         self.numberOfCrashes = 0 # tracks the number of crashes for debugging purposes
 
         self.trackSize = 0 # number of non-wall elements
-        self.trackIDs = {} # stores a list of non-wall element locations [row, column], as ordered by sequential access of (row, column) index.
-        self.trackLocs = {} # stores all sequential access non-wall indexes, keys being a string representing the [row, column]
+        self.trackCoords = None # (trackSize, 2) int array, [row, column] of every non-wall cell in sequential (row, column) order.
+        # the row of a cell in it is the cell's trackID
+        self.trackIndex = None # grid of trackShape holding the trackID of every non-wall cell, -1 for walls (stateDtype)
         self.startingCells = [] # contains array of all starting cells. 
         # For value iteration, the best of self.valIterStates[startingCell][0][0][startingAccx][startingAccy] will be selected as our first position/move.
         # Then, we will greedily follow that gradient to the finish to obtain our optimal path.
@@ -53,22 +135,64 @@ class Track:
                     self.trackLocs.update({str([row, col]) : self.trackSize})
                     self.trackSize += 1''' 
 
-        for row in range(self.trackShape[0]):
-            for col in range(self.trackShape[1]):
-                item = self.track[row][col]
-                if item == 1:
-                    self.startingCells.append((row, col))  
-                if item in (0, 1, 2):
-                    self.trackIDs[self.trackSize] = (row, col)   
-                    self.trackLocs[(row, col)] = self.trackSize  
-                    self.trackSize += 1
+        self.startingCells = [(int(row), int(col)) for row, col in np.argwhere(self.track == 1)]
+        self.trackCoords = np.argwhere(self.track != 3) # argwhere is row-major, so this is sequential access order
+        self.trackSize = self.trackCoords.shape[0]
+        # integer type of flat states (trackID * 121 + ...): int32 while every state fits, int64 for larger tracks so
+        # trackID * 121 cannot wrap around. trackIndex uses it too, since flat states are computed from it
+        self.stateDtype = np.int32 if (self.trackSize * 121 <= np.iinfo(np.int32).max) else np.int64
+        self.trackIndex = np.full(self.trackShape, -1, dtype = self.stateDtype)
+        self.trackIndex[self.trackCoords[:, 0], self.trackCoords[:, 1]] = np.arange(self.trackSize, dtype = self.stateDtype)
+        # Chebyshev distance from every cell to the nearest '#' or 'F' cell, capped at 6 (one more than the top speed).
+        # a move whose speed max(|vx|, |vy|) is below it cannot reach either, so it needs no substep checks
+        self.wallDistance = self.getWallDistanceGrid()
                     
         # array to contain the score for every possible state. The state is represented as:
         # trackID, x velocity, y velocity, x acceleration, y acceleration
-        self.valIterStates = np.zeros((self.trackSize, 11, 11, 3, 3), dtype = float)
-        self.resultingStates = np.zeros((self.trackSize, 11, 11, 3, 3, 3), dtype = int) # lookup table for resulting states from valIterStates
+        # only allocated (by allocateValueTables) when value or policy iteration actually runs
+        self.valueDtype = valueDtype # float, or np.float32 to halve the value tables
+        # with a scratchDir, the big tables are np.memmap files in a fresh folder inside it (see createTable) so tracks
+        # larger than memory can be solved. blockSize is how many flat states are compiled / swept at a time
+        # (None: everything at once, or 2**18 states when using a scratchDir).
+        self.scratchPath = tempfile.mkdtemp(prefix = 'track_', dir = scratchDir) if scratchDir is not None else None
+        if (blockSize is None) and (scratchDir is not None):
+            blockSize = 2**18
+        self.blockSize = blockSize
+        self.valIterStates = None
+        self.resultingStates = None # lookup table for resulting states from valIterStates, only used by the 'loop' backup
+        # flat next state (stateDtype, trackID * 121 + (vx + 5) * 11 + (vy + 5)) for every (flat state, action index
+        # (ax + 1) * 3 + (ay + 1)), shape (states, 9), and True where that move ends on the finish line. Set by compileTransitions
+        self.nextStateTable = None
+        self.finishStates = None
+        # with a cacheDir, compileTransitions keeps its tables there as .npz files named by the hash of the track text
+        # and crash mode, and loads them instead of compiling when the same track comes up again. The least recently
+        # used files are deleted once the folder holds more than cacheBytes.
+        self.cacheDir = cacheDir
+        self.cacheBytes = cacheBytes
+        # stochastic model over flat states (trackID * 121 + (vx + 5) * 11 + (vy + 5)) x 9 accelerations, set by compileMDP
+        self.transitionMatrix = None # sparse (states * 9, states), row state * 9 + action holds 0.8 success / 0.2 failure
+        self.rewardVector = None # reward of every (state, action) row
+        self.terminalStates = None # True for states on the finish line
+        self.stateValues = None # V(s) = best value of every flat state, used by the sparse solver
+        self.nextStates = None # flat next state for every (flat state, action), shape (states, 9), set by compileMDP
+        self.sweepLayers = None # flat states grouped by finish distance of their cell, closest first (Gauss-Seidel order)
+        self.predecessorMatrix = None # sparse (states, states), [s, t] is 1 when some action of t can lead to s
+        self.prioritySelection = None # states to back up in the next prioritized sweep (None means all)
+        self.activeStates = None # flat IDs of the states kept by pruneStates, in compact order (None when not pruned)
+        self.qTable = None # (states, 9) action values the value iteration sweeps work on
+        self.sweepPool = None # worker processes of the parallel backup
+        self.sharedBlocks = [] # shared memory blocks behind the parallel backup's tables
+        self.sharedValues = None # (2, states) shared value buffers, the parallel backup reads one and writes the other
+        self.readBuffer = 0 # which of self.sharedValues holds the latest values
+        self.shards = [] # (start, end) model state ranges, one task each per parallel sweep
+        self.blockValues = None # (2, states) value buffers of the blocked backup, it reads one and writes the other
+        self.lastResidual = 0.0 # largest value change of the last blocked or parallel sweep
+
+        self.qVals = None # (states, 9) Q table of the last Q-learning / SARSA run, rows and columns like qTable
 
         self.opCount = 0
+        self.sweepCount = 0 # value iteration sweeps run before stopping
+        self.residuals = [] # largest value change of every value iteration sweep
         
     # ---------------- END INSTANTIATION ------------------
 
@@ -93,11 +217,8 @@ class Track:
         finish_row = fCells[0][0]
 
         # find close no wall states to use as goal while coding helps for exploration
-        goal_zone_ids = []
-        for tid, (r, c) in self.trackIDs.items():
-            # includes states from last rows above finish (3 now can change)
-            if r >= finish_row - 3:
-                goal_zone_ids.append(tid)
+        # includes states from last rows above finish (3 now can change)
+        goal_zone_ids = np.flatnonzero(self.trackCoords[:, 0] >= finish_row - 3).tolist()
 
         return finish_row, goal_zone_ids
 
@@ -116,6 +237,10 @@ class Track:
 
     def getOperations(self):
         return self.opCount
+
+    def getSweepCount(self):
+        # number of value iteration sweeps actually run
+        return self.sweepCount
         
     '''    
     def getIsStart(self, posiiton):
@@ -195,6 +320,11 @@ class Track:
         # if collision is detected, unconditionally update position to the previous tested position and move to next steps
         # (keeps moving until it's up against wall it collides with)
         # if finish line is encountered, stop it there. 
+        if self.wallDistance[self.position[0], self.position[1]] > max(abs(self.velocity[0]), abs(self.velocity[1])):
+            # every substep stays on open track
+            self.position[0] += self.velocity[0]
+            self.position[1] += self.velocity[1]
+            return collisionOccurred
         xCounter = 0
         yCounter = 0
         for i in range(5):
@@ -243,7 +373,7 @@ class Track:
         self.acceleration[1] = move[5]
         self.updateVelocity()
         self.updatePosition()
-        trackID = self.trackLocs[(int(self.position[0]), int(self.position[1]))]
+        trackID = int(self.trackIndex[self.position[0], self.position[1]])
         resultingState = [trackID, self.velocity[0], self.velocity[1], self.acceleration[0], self.acceleration[1]]
         return resultingState
 
@@ -257,12 +387,382 @@ class Track:
         self.updateVelocity()
         self.updatePosition()
         Finishes = False
-        oldTrackID = self.trackLocs[(move[0], move[1])]
-        trackID = self.trackLocs[(int(self.position[0]), int(self.position[1]))]
+        oldTrackID = int(self.trackIndex[move[0], move[1]])
+        trackID = int(self.trackIndex[self.position[0], self.position[1]])
         self.resultingStates[oldTrackID][move[2] + 5][move[3] + 5][move[4] + 1][move[5] + 1] = np.array([trackID, self.velocity[0] + 5, self.velocity[1] + 5])
         if (self.track[self.position[0]][self.position[1]] == 2):
             Finishes = True
         return Finishes # returns false if move does not complete the race.
+
+    def compileTransitions(self, partner = None):
+        # builds all of self.nextStateTable at once, plus self.finishStates (True where the move ends on 'F').
+        # Same rules as attemptFinish, but for every cell together: the substep offsets int(k*v/5) depend only on the
+        # new velocity, so each of the 121 velocities is checked against the whole track with one mask per substep.
+        # With a blockSize, cells are compiled a block at a time so only the output tables need to be full size.
+        # partner is a Track of the same grid with the other crash mode: its tables are filled from the same ray traces
+        # (nothing is compiled if both tracks find theirs in their cacheDir).
+        tracks = [self] if partner is None else [self, partner]
+        if all((track.cacheDir is not None) and track.loadCachedTransitions() for track in tracks):
+            return
+        allCoords = self.trackCoords
+        idGrid = self.trackIndex
+
+        numStates = self.trackSize * 121
+        for track in tracks:
+            track.nextStateTable = track.createTable('nextStateTable', (numStates, 9), self.stateDtype)
+            track.finishStates = track.createTable('finishStates', (numStates, 9), bool)
+        cellsPerBlock = self.trackSize if self.blockSize is None else max(1, self.blockSize // 121)
+        for blockStart in range(0, self.trackSize, cellsPerBlock):
+            coords = allCoords[blockStart:blockStart + cellsPerBlock]
+            self.compileTransitionBlock(coords, idGrid, blockStart, tracks)
+        for track in tracks:
+            if track.cacheDir is not None:
+                track.saveCachedTransitions(allCoords)
+        return
+
+    def compileTransitionBlock(self, coords, idGrid, firstID, tracks = None):
+        # compileTransitions for the cells at coords (trackIDs firstID onward), into the tables of every Track in
+        # tracks (default: just this one)
+        if tracks is None:
+            tracks = [self]
+        numCells = coords.shape[0]
+        # resulting flat state / finish flag for every track and new velocity, indexed [track][vx + 5][vy + 5][cell]
+        nextFlat = np.zeros((len(tracks), 11, 11, numCells), dtype = self.stateDtype)
+        nextFinish = np.zeros((len(tracks), 11, 11, numCells), dtype = bool)
+        for xvelVal in range(-5, 6):
+            for yvelVal in range(-5, 6):
+                outcomes = self.traceVelocity(coords, xvelVal, yvelVal, idGrid, [track.crashReset for track in tracks])
+                for index, (flat, finishes) in enumerate(outcomes):
+                    nextFlat[index, xvelVal + 5, yvelVal + 5] = flat
+                    nextFinish[index, xvelVal + 5, yvelVal + 5] = finishes
+
+        # new velocity (clamped like updateVelocity) for every (velocity, acceleration), indexed [v + 5][a + 1]
+        newVelIndex = np.clip(np.arange(-5, 6)[:, None] + np.arange(-1, 2)[None, :], -5, 5) + 5
+        vx = newVelIndex[:, None, :, None] # broadcasts to (11, 11, 3, 3)
+        vy = newVelIndex[None, :, None, :]
+        rows = slice(firstID * 121, (firstID + numCells) * 121)
+        for index, track in enumerate(tracks):
+            track.nextStateTable[rows] = nextFlat[index][vx, vy].transpose(4, 0, 1, 2, 3).reshape(numCells * 121, 9)
+            track.finishStates[rows] = nextFinish[index][vx, vy].transpose(4, 0, 1, 2, 3).reshape(numCells * 121, 9)
+        return
+
+    def traceVelocity(self, coords, xvelVal, yvelVal, idGrid, crashModes = None):
+        # flat next state and finish flag of every cell at coords when its new velocity is (xvelVal, yvelVal).
+        # The ray is traced once; one (nextFlat, finishes) pair is returned per crashReset value in crashModes
+        # (default: this track's), since the modes only differ in where a crashed car ends up.
+        if crashModes is None:
+            crashModes = [self.crashReset]
+        numCells = coords.shape[0]
+        # no collision: car ends at position + velocity
+        endRow = coords[:, 0] + xvelVal
+        endCol = coords[:, 1] + yvelVal
+        endVelX = np.full(numCells, xvelVal)
+        endVelY = np.full(numCells, yvelVal)
+        crashed = np.zeros(numCells, dtype = bool)
+        # only cars within reach of a '#' or 'F' (see self.wallDistance) need their substeps checked
+        near = np.flatnonzero(self.wallDistance[coords[:, 0], coords[:, 1]] <= max(abs(xvelVal), abs(yvelVal)))
+        nearRow = coords[near, 0]
+        nearCol = coords[near, 1]
+        moving = np.ones(near.size, dtype = bool) # near cars that have not stopped on 'F' or '#' yet
+        for i in range(1, 6):
+            rowStep = nearRow + int(i * xvelVal / 5)
+            colStep = nearCol + int(i * yvelVal / 5)
+            # cars that already stopped may step past the border, clip so their lookup stays on the grid
+            locType = self.track[np.clip(rowStep, 0, self.trackShape[0] - 1), np.clip(colStep, 0, self.trackShape[1] - 1)]
+            hitFinish = moving & (locType == 2)
+            endRow[near[hitFinish]] = rowStep[hitFinish]
+            endCol[near[hitFinish]] = colStep[hitFinish]
+            hitWall = moving & (locType == 3)
+            # NRST position for now, STRT cars are moved to the start below
+            hitCells = near[hitWall]
+            endRow[hitCells] = nearRow[hitWall] + int((i - 1) * xvelVal / 5)
+            endCol[hitCells] = nearCol[hitWall] + int((i - 1) * yvelVal / 5)
+            endVelX[hitCells] = 0
+            endVelY[hitCells] = 0
+            crashed[hitCells] = True
+            moving &= ~(hitFinish | hitWall)
+        outcomes = []
+        for crashReset in crashModes:
+            if crashReset:
+                modeRow = np.where(crashed, self.startingCells[0][0], endRow)
+                modeCol = np.where(crashed, self.startingCells[0][1], endCol)
+            else:
+                modeRow = endRow
+                modeCol = endCol
+            nextFlat = idGrid[modeRow, modeCol] * 121 + (endVelX + 5) * 11 + (endVelY + 5)
+            # checked on the final cell like attemptFinish (a car on 'F' that crashes on its first substep stays on 'F')
+            outcomes.append((nextFlat, self.track[modeRow, modeCol] == 2))
+        return outcomes
+
+    def compileTransitionsIncremental(self, oldTrack, oldNextStates, oldFinishStates):
+        # builds self.nextStateTable / self.finishStates from the tables compiled for oldTrack (same shape, same
+        # crash mode and first start cell). Only moves whose ray (the cells at substeps 0 to 5) touches a cell that
+        # differs between the two grids are traced again, every other move is copied over with its trackIDs renumbered.
+        # Returns the number of (cell, new velocity) rays traced.
+        newCoords = self.trackCoords
+        oldCoords = np.argwhere(oldTrack != 3) # row-major, the order trackCoords had for oldTrack
+        idGrid = self.trackIndex
+        oldIdGrid = np.full(self.trackShape, -1, dtype = int)
+        oldIdGrid[oldCoords[:, 0], oldCoords[:, 1]] = np.arange(oldCoords.shape[0])
+
+        numStates = self.trackSize * 121
+        self.nextStateTable = self.createTable('nextStateTable', (numStates, 9), self.stateDtype)
+        self.finishStates = self.createTable('finishStates', (numStates, 9), bool)
+        oldIDs = oldIdGrid[newCoords[:, 0], newCoords[:, 1]] # -1 for cells that used to be walls
+        keptIDs = np.flatnonzero(oldIDs >= 0)
+        keptRows = (keptIDs[:, None] * 121 + np.arange(121)).ravel()
+        oldRows = (oldIDs[keptIDs][:, None] * 121 + np.arange(121)).ravel()
+        oldToNew = idGrid[oldCoords[:, 0], oldCoords[:, 1]]
+        oldTargets = np.asarray(oldNextStates[oldRows])
+        # targets that are walls now come out negative here, their rays cross a changed cell so they are traced again
+        self.nextStateTable[keptRows] = oldToNew[oldTargets // 121] * 121 + oldTargets % 121
+        self.finishStates[keptRows] = oldFinishStates[oldRows]
+
+        # every (velocity index, action index) whose clamped new velocity is (nvx, nvy), indexed [nvx + 5][nvy + 5]
+        velocityActions = [[[] for _ in range(11)] for _ in range(11)]
+        for velIndex in range(121):
+            for action in range(9):
+                nvx = min(max(velIndex // 11 - 5 + action // 3 - 1, -5), 5)
+                nvy = min(max(velIndex % 11 - 5 + action % 3 - 1, -5), 5)
+                velocityActions[nvx + 5][nvy + 5].append((velIndex, action))
+
+        changed = oldTrack != self.track
+        traced = 0
+        for xvelVal in range(-5, 6):
+            for yvelVal in range(-5, 6):
+                touched = np.zeros(self.trackSize, dtype = bool)
+                for i in range(6):
+                    rowStep = np.clip(newCoords[:, 0] + int(i * xvelVal / 5), 0, self.trackShape[0] - 1)
+                    colStep = np.clip(newCoords[:, 1] + int(i * yvelVal / 5), 0, self.trackShape[1] - 1)
+                    touched |= changed[rowStep, colStep]
+                cells = np.flatnonzero(touched)
+                if (cells.size == 0):
+                    continue
+                nextFlat, finishes = self.traceVelocity(newCoords[cells], xvelVal, yvelVal, idGrid)[0]
+                for velIndex, action in velocityActions[xvelVal + 5][yvelVal + 5]:
+                    self.nextStateTable[cells * 121 + velIndex, action] = nextFlat
+                    self.finishStates[cells * 121 + velIndex, action] = finishes
+                traced += cells.size
+        return traced
+
+    def createTable(self, name, shape, dtype):
+        # zeroed table, kept in memory or, with a scratch folder, as a memory mapped file that the OS pages in and out
+        if self.scratchPath is None:
+            return np.zeros(shape, dtype = dtype)
+        return np.memmap(os.path.join(self.scratchPath, name + '.dat'), dtype = dtype, mode = 'w+', shape = shape)
+
+    def removeScratch(self):
+        # deletes the memory mapped tables, the Track cannot be solved again afterwards
+        if self.scratchPath is not None:
+            self.valIterStates = None
+            self.resultingStates = None
+            self.nextStateTable = None
+            self.finishStates = None
+            self.nextStates = None
+            self.terminalStates = None
+            self.qTable = None
+            self.stateValues = None
+            self.blockValues = None
+            shutil.rmtree(self.scratchPath, ignore_errors = True)
+            self.scratchPath = None
+        return
+
+    def getCachePath(self):
+        # cache file of this track: sha256 of the grid shape, the track text (its unicode code points, read straight
+        # from the str array's memory) and the crash mode
+        key = hashlib.sha256()
+        key.update(str(self.inputTextArray.shape).encode())
+        key.update(np.ascontiguousarray(self.inputTextArray, dtype = '<U1').view(np.uint32).tobytes())
+        key.update(b'STRT' if self.crashReset else b'NRST')
+        return os.path.join(self.cacheDir, key.hexdigest() + '.npz')
+
+    def loadCachedTransitions(self):
+        # fills self.nextStateTable / self.finishStates from the cache, True on a hit
+        cachePath = self.getCachePath()
+        if not os.path.exists(cachePath):
+            return False
+        try:
+            with np.load(cachePath) as cached:
+                if not np.array_equal(cached['trackCoords'], self.trackCoords): # stale or colliding entry
+                    return False
+                numStates = self.trackSize * 121
+                self.nextStateTable = self.createTable('nextStateTable', (numStates, 9), self.stateDtype)
+                self.finishStates = self.createTable('finishStates', (numStates, 9), bool)
+                self.nextStateTable[:] = cached['nextStateTable']
+                self.finishStates[:] = cached['finishStates']
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile): # unreadable (e.g. half written) entry, compile again
+            return False
+        os.utime(cachePath) # mark as recently used
+        print("loaded compiled transitions from " + cachePath)
+        return True
+
+    def saveCachedTransitions(self, coords):
+        # stores the compiled tables with the (row, column) of every trackID, then evicts least recently used files
+        os.makedirs(self.cacheDir, exist_ok = True)
+        cachePath = self.getCachePath()
+        partialPath = cachePath[:-4] + '.' + str(os.getpid()) + '.part'
+        with open(partialPath, 'wb') as f:
+            np.savez(f, trackCoords = coords, nextStateTable = np.asarray(self.nextStateTable), finishStates = np.asarray(self.finishStates))
+        os.replace(partialPath, cachePath) # other runs never see a half written file
+        entries = []
+        for name in os.listdir(self.cacheDir):
+            if name.endswith('.npz'):
+                info = os.stat(os.path.join(self.cacheDir, name))
+                entries.append((info.st_mtime, info.st_size, name))
+        entries.sort()
+        totalBytes = sum(size for _, size, _ in entries)
+        for _, size, name in entries: # oldest first, the file just written is the newest
+            if (totalBytes <= self.cacheBytes) or (name == os.path.basename(cachePath)):
+                break
+            os.remove(os.path.join(self.cacheDir, name))
+            totalBytes -= size
+        return
+
+    def compileMDP(self):
+        # turns the transition table into a sparse matrix so a whole sweep is one matrix-vector product.
+        # Row (state * 9 + action) puts 0.8 on the state reached when the acceleration works and 0.2 on the state
+        # reached when it fails (acceleration (0, 0), action index 4). Every move costs 1, finish states end the race.
+        if sparse is None:
+            raise ImportError("sparse value iteration needs scipy")
+        if self.nextStateTable is None:
+            self.compileTransitions()
+        numStates = self.trackSize * 121
+        self.nextStates = self.nextStateTable # pruneStates replaces this with a compact copy
+        self.activeStates = None
+        self.transitionMatrix = self.buildTransitionMatrix(self.nextStates, numStates)
+
+        self.terminalStates = self.getTerminalStates()
+        self.rewardVector = np.where(np.repeat(self.terminalStates, 9), 0.0, -1.0)
+        return
+
+    def getTerminalStates(self):
+        # True for every flat state on the finish line
+        onFinish = self.track[self.trackCoords[:, 0], self.trackCoords[:, 1]] == 2
+        terminalStates = self.createTable('terminalStates', (self.trackSize * 121,), bool)
+        terminalStates[:] = np.repeat(onFinish, 121)
+        return terminalStates
+
+    def buildTransitionMatrix(self, nextStates, numColumns):
+        # sparse (len(nextStates) * 9, numColumns) matrix of the 0.8 success / 0.2 failure outcomes of nextStates
+        numRows = nextStates.shape[0] * 9
+        rows = np.arange(numRows)
+        matrix = sparse.coo_matrix((np.concatenate((np.full(numRows, SUCCESS_PROBABILITY), np.full(numRows, FAIL_PROBABILITY))),
+                                    (np.concatenate((rows, rows)),
+                                     np.concatenate((nextStates.ravel(), np.repeat(nextStates[:, 4], 9))))),
+                                   shape = (numRows, numColumns))
+        return matrix.astype(self.valueDtype).tocsr() # duplicate entries (action 4 succeeding or failing) are summed
+
+    def pruneStates(self):
+        # keeps only states that can be reached from a start cell at zero velocity and that can still reach 'F'.
+        # The compiled model is re-indexed to those states (self.activeStates maps back to flat IDs). A move into a
+        # state that can never finish goes to one extra sentinel column, whose value is fixed to never finishing.
+        # If no start state can finish at all, nothing is pruned and the solve runs on every state (and finds no path).
+        numStates = self.nextStates.shape[0]
+        forward = np.zeros(numStates, dtype = bool)
+        frontier = np.unique(self.trackIndex[tuple(np.array(self.startingCells).T)].astype(int) * 121 + 60) # 60 is velocity (0, 0)
+        while frontier.size > 0:
+            forward[frontier] = True
+            expand = frontier[~self.terminalStates[frontier]] # the race ends on 'F'
+            reached = np.unique(self.nextStates[expand].ravel())
+            frontier = reached[~forward[reached]]
+
+        # [t, s] is 1 when some action of t leads to s
+        successorMatrix = sparse.csr_matrix((np.ones(numStates * 9), (np.repeat(np.arange(numStates), 9), self.nextStates.ravel())),
+                                            shape = (numStates, numStates))
+        backward = self.terminalStates.copy()
+        frontier = backward.copy()
+        while frontier.any():
+            reached = (successorMatrix @ frontier.astype(float)) > 0
+            frontier = reached & ~backward
+            backward |= frontier
+
+        keep = np.flatnonzero(forward & backward)
+        if (keep.size == 0):
+            print("no state reachable from the start can reach the finish line, solving every state")
+            return
+        self.activeStates = keep
+        numActive = self.activeStates.size
+        compactIndex = np.full(numStates, numActive, dtype = self.stateDtype) # everything not kept points at the sentinel
+        compactIndex[self.activeStates] = np.arange(numActive)
+        self.nextStates = compactIndex[self.nextStates[self.activeStates]]
+        self.terminalStates = self.terminalStates[self.activeStates]
+        self.rewardVector = np.where(np.repeat(self.terminalStates, 9), 0.0, -1.0)
+        self.transitionMatrix = self.buildTransitionMatrix(self.nextStates, numActive + 1)
+        print("States kept after pruning: " + str(numActive) + " of " + str(numStates))
+        return
+
+    def getFinishDistances(self):
+        # getFinishDistanceGrid, per trackID
+        distance = self.getFinishDistanceGrid()
+        return distance[self.trackCoords[:, 0], self.trackCoords[:, 1]]
+
+    def getFinishDistanceGrid(self):
+        # breadth first search distance (in king moves through non-wall cells) from the finish line for every cell.
+        # cells that cannot reach the line get one more than the largest distance found, walls stay -1.
+        openCells = self.track != 3
+        distance = np.full(self.trackShape, -1, dtype = int)
+        frontier = self.track == 2
+        step = 0
+        while frontier.any():
+            distance[frontier] = step
+            # every cell next to the frontier (8 neighbours) that has not been reached yet
+            grown = frontier.copy()
+            grown[1:, :] |= frontier[:-1, :]
+            grown[:-1, :] |= frontier[1:, :]
+            grown[:, 1:] |= grown[:, :-1].copy()
+            grown[:, :-1] |= grown[:, 1:].copy()
+            frontier = grown & openCells & (distance == -1)
+            step += 1
+        distance[openCells & (distance == -1)] = step
+        return distance
+
+    def getWallDistanceGrid(self):
+        # self.wallDistance: Chebyshev distance to the nearest '#' or 'F' (cells off the grid count as '#'), capped at 6
+        blocked = np.ones((self.trackShape[0] + 2, self.trackShape[1] + 2), dtype = bool)
+        blocked[1:-1, 1:-1] = (self.track == 3) | (self.track == 2)
+        distance = np.full(self.trackShape, 6, dtype = np.int8)
+        for step in range(6):
+            distance[blocked[1:-1, 1:-1] & (distance == 6)] = step
+            # grow by one king move
+            grown = blocked.copy()
+            grown[1:, :] |= blocked[:-1, :]
+            grown[:-1, :] |= blocked[1:, :]
+            grown[:, 1:] |= grown[:, :-1].copy()
+            grown[:, :-1] |= grown[:, 1:].copy()
+            blocked = grown
+        return distance
+
+    def compileSweepOrder(self):
+        # Gauss-Seidel order: values spread backward from 'F', so states closest to the finish are backed up first
+        # and every later layer already sees this sweep's values. Also builds the predecessor lookup used to pick
+        # the states worth revisiting in prioritized sweeps.
+        if self.nextStates is None:
+            self.compileMDP()
+        numStates = self.nextStates.shape[0]
+        stateIDs = self.activeStates if self.activeStates is not None else np.arange(numStates)
+        stateDistance = self.getFinishDistances()[stateIDs // 121]
+        order = np.argsort(stateDistance, kind = 'stable')
+        splits = np.flatnonzero(np.diff(stateDistance[order])) + 1
+        self.sweepLayers = np.split(order, splits)
+
+        rows = self.nextStates.ravel()
+        cols = np.repeat(np.arange(numStates), 9)
+        kept = rows < numStates # the pruning sentinel never changes, so it has no use for predecessors
+        self.predecessorMatrix = sparse.csr_matrix((np.ones(int(kept.sum())), (rows[kept], cols[kept])), shape = (numStates, numStates))
+        self.prioritySelection = None
+        return
+
+    def simulateMove(self, state, xacc, yacc):
+        # (row, col, vx, vy) reached from state with acceleration (xacc, yacc), using updateVelocity / updatePosition
+        self.position[0] = state[0]
+        self.position[1] = state[1]
+        self.velocity[0] = state[2]
+        self.velocity[1] = state[3]
+        self.acceleration[0] = xacc
+        self.acceleration[1] = yacc
+        self.updateVelocity()
+        self.updatePosition()
+        return (int(self.position[0]), int(self.position[1]), int(self.velocity[0]), int(self.velocity[1]))
     # ------------------------ END DO MOVE ---------------------------------
 
     # ************************** END SHARED METHODS *******************************
@@ -270,25 +770,135 @@ class Track:
 
     # ************************** VALUE ITERATION METHODS *******************************
     # ------------------------ DO VALUE ITERATION ---------------------------------
-    def doValueIteration(self):
-        self.doIterationK0()
-        self.doIterationK1()
+    def doValueIteration(self, backup = 'loop', epsilon = 0.0, maxSweeps = 98, policyPatience = None, prune = False, workers = None,
+                         initialValues = None):
+        # backup selects how each sweep is computed: 'loop' walks every state in python, 'vector' does the same
+        # backup with numpy array operations (same valIterStates, much faster), 'sparse' runs the full expected-value
+        # Bellman backup for the 0.8/0.2 model as sparse matrix-vector products, 'gaussSeidel' runs the same backup
+        # in place, closest states to the finish first, and 'prioritized' does that once and afterwards only revisits
+        # states whose successors changed by more than epsilon, 'parallel' runs the sparse backup split across
+        # workers processes (default: every core) on tables in shared memory, and 'blocked' runs the same backup
+        # streaming through the tables blockSize states at a time (for memory mapped tables, see scratchDir)
+        # sweeps stop once the largest change in valIterStates (the Bellman residual) is at most epsilon, once the
+        # greedy policy has not changed for policyPatience sweeps in a row (None to disable), or after maxSweeps
+        # sweeps (k runs from 2 to 99 by default, like before). self.residuals and self.sweepCount record the run.
+        # prune (sparse, gaussSeidel and prioritized only) solves just the states pruneStates keeps.
+        # initialValues (every backup but loop and vector) is a warm start: V for every flat state instead of 0.
+        # Any other backup raises ValueError.
+        backups = ('loop', 'vector', 'sparse', 'gaussSeidel', 'prioritized', 'parallel', 'blocked')
+        if backup not in backups:
+            raise ValueError("unknown value iteration backup " + repr(backup) + ", expected one of " + ", ".join(backups))
+        flatModel = backup in ('sparse', 'gaussSeidel', 'prioritized', 'parallel')
+        self.allocateValueTables(loopBackup = (backup == 'loop'))
+        if (backup == 'blocked'):
+            # no sparse matrix (it would need the whole model in memory), the sweeps gather from nextStates directly
+            if prune:
+                print("prune is not available for the blocked backup, solving every state")
+            if self.nextStateTable is None:
+                self.compileTransitions()
+            self.nextStates = self.nextStateTable
+            self.activeStates = None
+            self.terminalStates = self.getTerminalStates()
+            self.qTable = self.valIterStates.reshape(-1, 9) # view, sweeps write valIterStates directly
+            self.blockValues = self.createTable('blockValues', (2, self.trackSize * 121), self.valueDtype)
+            self.readBuffer = 0
+            if initialValues is not None:
+                self.blockValues[0] = np.where(self.terminalStates, 0.0, initialValues)
+        elif flatModel:
+            self.compileMDP()
+            if prune:
+                self.pruneStates()
+            if (backup != 'sparse'):
+                self.compileSweepOrder()
+            self.qTable = self.createTable('qTable', (self.nextStates.shape[0], 9), self.valueDtype)
+            self.stateValues = np.zeros(self.transitionMatrix.shape[1], dtype = self.valueDtype)
+            if self.activeStates is not None:
+                self.stateValues[-1] = NEVER_FINISH_VALUE # sentinel
+            if initialValues is not None:
+                stateIDs = self.activeStates if self.activeStates is not None else slice(None)
+                self.stateValues[:self.qTable.shape[0]] = np.where(self.terminalStates, 0.0, initialValues[stateIDs])
+        else:
+            if prune:
+                print("prune needs the sparse, gaussSeidel or prioritized backup, solving every state")
+            if initialValues is not None:
+                print("the loop and vector backups cannot be warm started, starting from 0")
+            if (backup == 'vector'):
+                self.doIterationK0Vectorized()
+                self.doIterationK1Vectorized()
+            else:
+                self.doIterationK0()
+                self.doIterationK1()
+            self.qTable = self.valIterStates.reshape(-1, 9) # view, sweeps write valIterStates directly
+        self.residuals = []
+        self.sweepCount = 0
+        previousPolicy = None
+        stableSweeps = 0
         valueUpdated = True
         k = 2
-        while valueUpdated and (k < 100):
-            print("k: " + str(k))
-            valueUpdated = self.doIterationKn(k)
-            k += 1
+        try:
+            if (backup == 'parallel'):
+                self.startParallelSweeps(workers)
+            while valueUpdated and (self.sweepCount < maxSweeps):
+                print("k: " + str(k))
+                if backup not in ('blocked', 'parallel'): # those measure their own residual, block / shard by shard
+                    oldValues = self.qTable.copy()
+                if (backup == 'sparse'):
+                    valueUpdated = self.doIterationSparse()
+                elif (backup == 'gaussSeidel'):
+                    valueUpdated = self.doIterationGaussSeidel()
+                elif (backup == 'prioritized'):
+                    valueUpdated = self.doIterationGaussSeidel(prioritized = True, threshold = epsilon)
+                elif (backup == 'parallel'):
+                    valueUpdated = self.doIterationParallel()
+                elif (backup == 'blocked'):
+                    valueUpdated = self.doIterationBlocked()
+                elif (backup == 'vector'):
+                    valueUpdated = self.doIterationKnVectorized(k)
+                else:
+                    valueUpdated = self.doIterationKn(k)
+                if backup in ('blocked', 'parallel'):
+                    residual = self.lastResidual
+                else:
+                    residual = float(np.max(np.abs(self.qTable - oldValues), initial = 0.0)) # 0 for an empty model
+                self.residuals.append(residual)
+                self.sweepCount += 1
+                k += 1
+                if (residual <= epsilon):
+                    break
+
+                if policyPatience is not None:
+                    policy = self.qTable.argmax(axis = 1)
+                    if (previousPolicy is not None) and np.array_equal(policy, previousPolicy):
+                        stableSweeps += 1
+                    else:
+                        stableSweeps = 0
+                    previousPolicy = policy
+                    if (stableSweeps >= policyPatience):
+                        break
+            print("Sweeps: " + str(self.sweepCount) + ", final residual: " + str(self.residuals[-1] if self.residuals else 0.0))
+            if flatModel:
+                self.storeQTable()
+        finally: # the pool and shared memory blocks are freed even if a sweep fails
+            if (backup == 'parallel'):
+                self.stopParallelSweeps()
+        if (backup == 'blocked'):
+            self.stateValues = self.blockValues[self.readBuffer]
+
+        self.extractBestPath()
+        return
 
+    def extractBestPath(self, maxSteps = 500):
         # next, find best starting conditions (use self.startingCells), then follow the gradient greedily to track path to finish line.
         # update self.moves and self.bestPath along the way
         # from the best starting cell, track best path deterministically to finish (we are just recording our findings, this is not 
         # an actual simulation)
+        # a solve stopped early (epsilon, policyPatience, maxSweeps) may not lead to 'F' yet, so the walk ends after maxSteps
+        # moves like evaluateQTable's, and the path that far is kept
         
-        bestStart = [self.trackLocs[self.startingCells[0]], 0, 0]
+        bestStart = [int(self.trackIndex[self.startingCells[0]]), 0, 0]
         bestStartValue = -99999
         for cell in self.startingCells:
-            startingID = self.trackLocs[cell]
+            startingID = int(self.trackIndex[cell])
             for xaccIndex in range(3):
                 for yaccIndex in range(3):
                     startValue = self.valIterStates[startingID][5][5][xaccIndex][yaccIndex]
@@ -296,9 +906,12 @@ class Track:
                         bestStart = [startingID, xaccIndex, yaccIndex]
                         bestStartValue = startValue
                         
-        startPosition = self.trackIDs[bestStart[0]]
+        startPosition = self.trackCoords[bestStart[0]]
         self.position[0] = startPosition[0]
         self.position[1] = startPosition[1]
+        self.velocity[0] = 0
+        self.velocity[1] = 0
+        self.bestPath = []
         self.bestPath.append([self.position[0], self.position[1]])
         self.acceleration[0] = bestStart[1] - 1
         self.acceleration[1] = bestStart[2] - 1
@@ -308,9 +921,12 @@ class Track:
         self.bestPath.append([self.position[0], self.position[1]])
         
         while self.track[self.position[0]][self.position[1]] != 2:
+            if (self.bestMoves >= maxSteps):
+                print("no path to the finish line: the greedy policy has not reached it in " + str(maxSteps) + " moves")
+                break
             bestMoveValue = -99999
             bestMove = [0, 0]
-            cellID = self.trackLocs[(int(self.position[0]), int(self.position[1]))]
+            cellID = int(self.trackIndex[self.position[0], self.position[1]])
             for xaccIndex in range(3):
                 for yaccIndex in range(3):
                     moveValue = self.valIterStates[cellID][self.velocity[0] + 5][self.velocity[1] + 5][xaccIndex][yaccIndex]
@@ -326,10 +942,190 @@ class Track:
         
         return
 
+    def doMultigridValueIteration(self, factor = 2, backup = 'gaussSeidel', epsilon = 1e-6, maxSweeps = 98, prune = False,
+                                  policyPatience = None):
+        # coarse-to-fine value iteration: solve a track with factor x factor cells merged into one (buildCoarseTrack),
+        # then warm start the full resolution solve from those values (converted to fine moves). backup is any backup
+        # that takes initialValues ('loop' and 'vector' raise ValueError). The warm start pays off with 'gaussSeidel'
+        # and 'prioritized', which carry values from the finish across the track within one sweep. The Jacobi backups
+        # ('sparse', 'parallel', 'blocked') only move them one move per sweep, so they save just a few sweeps.
+        # policyPatience (see doValueIteration) applies to the full resolution solve.
+        if backup in ('loop', 'vector'):
+            raise ValueError("multigrid value iteration needs a backup that takes initialValues, not '" + backup + "'")
+        coarse = self.buildCoarseTrack(factor)
+        if coarse is None:
+            print("coarse track has no start cell, solving at full resolution")
+            self.doValueIteration(backup, epsilon, maxSweeps, policyPatience, prune = prune)
+            return
+        print("solving " + str(factor) + "x coarser track (" + str(coarse.trackSize) + " of " + str(self.trackSize) + " cells)")
+        coarse.doValueIteration(backup, epsilon, maxSweeps)
+        self.opCount += coarse.getOperations()
+        coarseValues = coarse.valIterStates.reshape(coarse.trackSize, 11, 11, 9).max(axis = 3)
+        self.doValueIteration(backup, epsilon, maxSweeps, policyPatience, prune = prune,
+                              initialValues = self.interpolateCoarseValues(coarse, coarseValues, factor))
+        return
+
+    def buildCoarseTrack(self, factor):
+        # Track of this grid with factor x factor blocks merged: a block is 'F' if it holds any finish cell, else 'S'
+        # if it holds a start cell, else track if any of it is open, else wall. A wall border is added around it so
+        # merged edge blocks cannot leave the grid. Returns None if no start block is left.
+        rows = -(-self.trackShape[0] // factor)
+        cols = -(-self.trackShape[1] // factor)
+        padded = np.full((rows * factor, cols * factor), 3, dtype = self.track.dtype)
+        padded[:self.trackShape[0], :self.trackShape[1]] = self.track
+        blocks = padded.reshape(rows, factor, cols, factor).transpose(0, 2, 1, 3).reshape(rows, cols, factor * factor)
+        coarse = np.full((rows + 2, cols + 2), 3, dtype = self.track.dtype)
+        inner = np.where((blocks != 3).any(axis = 2), 0, 3)
+        inner[(blocks == 1).any(axis = 2)] = 1
+        inner[(blocks == 2).any(axis = 2)] = 2
+        coarse[1:-1, 1:-1] = inner
+        if not (coarse == 1).any():
+            return None
+        coarseText = np.array(['.', 'S', 'F', '#'])[coarse]
+        return Track(coarse, self.crashReset, coarseText, self.valueDtype)
+
+    def interpolateCoarseValues(self, coarse, coarseValues, factor):
+        # V for every fine flat state from coarseValues (coarse trackID, vx + 5, vy + 5): the block containing the cell,
+        # and velocity / factor interpolated bilinearly between the neighbouring whole coarse velocities
+        coarseIDs = coarse.trackIndex[self.trackCoords[:, 0] // factor + 1, self.trackCoords[:, 1] // factor + 1]
+        scaled = np.arange(-5, 6) / factor
+        low = np.floor(scaled).astype(int)
+        weight = scaled - low
+        high = np.minimum(low + 1, 5)
+        # a coarse move crosses factor fine cells per unit of speed, so m coarse moves (V = -(1 - DISCOUNT^m) / (1 - DISCOUNT))
+        # stand for about factor * m fine moves
+        fineValues = -(1 - np.maximum(1 + coarseValues * (1 - DISCOUNT), 0.0) ** factor) / (1 - DISCOUNT)
+        values = np.zeros((self.trackSize, 11, 11))
+        for xIndex, xWeight in ((low, 1 - weight), (high, weight)):
+            for yIndex, yWeight in ((low, 1 - weight), (high, weight)):
+                corner = fineValues[coarseIDs[:, None, None], xIndex[None, :, None] + 5, yIndex[None, None, :] + 5]
+                values += xWeight[None, :, None] * yWeight[None, None, :] * corner
+        return values.ravel()
+
+    def doIncrementalValueIteration(self, solvePath, backup = 'sparse', epsilon = 1e-6, maxSweeps = 98, prune = False,
+                                    policyPatience = None):
+        # re-solve after a track edit: solvePath (.npz) holds the grid, transitions and values of the last solve of this
+        # track. Only transitions whose rays touch an edited cell are traced again (compileTransitionsIncremental),
+        # values start from the old solution (new cells from 0), and sweeps run until epsilon. backup is any backup
+        # that takes initialValues ('loop' and 'vector' raise ValueError). The new solve is saved back to solvePath.
+        if backup in ('loop', 'vector'):
+            raise ValueError("incremental value iteration needs a backup that takes initialValues, not '" + backup + "'")
+        previous = None
+        if os.path.exists(solvePath):
+            try:
+                with np.load(solvePath) as saved: # closed again before solvePath is overwritten below
+                    previous = {name: saved[name] for name in ('track', 'crashReset', 'start', 'nextStateTable', 'finishStates', 'values')}
+            except (OSError, KeyError, ValueError, zipfile.BadZipFile): # unreadable (e.g. half written) file
+                previous = None
+        if previous is not None:
+            sameStart = (not self.crashReset) or (tuple(previous['start']) == tuple(self.startingCells[0]))
+            if (previous['track'].shape != self.trackShape) or (bool(previous['crashReset']) != self.crashReset) or not sameStart:
+                previous = None
+
+        if previous is None:
+            print("no matching previous solve in " + solvePath + ", solving from scratch")
+            self.doValueIteration(backup, epsilon, maxSweeps, policyPatience, prune = prune)
+        else:
+            oldTrack = previous['track']
+            print("cells edited since the last solve: " + str(int((oldTrack != self.track).sum())))
+            traced = self.compileTransitionsIncremental(oldTrack, previous['nextStateTable'], previous['finishStates'])
+            print("rays traced again: " + str(traced) + " of " + str(self.trackSize * 121))
+            self.opCount += traced
+
+            oldIdGrid = np.full(self.trackShape, -1, dtype = int)
+            oldCoords = np.argwhere(oldTrack != 3)
+            oldIdGrid[oldCoords[:, 0], oldCoords[:, 1]] = np.arange(oldCoords.shape[0])
+            oldIDs = oldIdGrid[self.trackCoords[:, 0], self.trackCoords[:, 1]]
+            initialValues = np.zeros((self.trackSize, 121))
+            initialValues[oldIDs >= 0] = previous['values'].reshape(-1, 121)[oldIDs[oldIDs >= 0]]
+            self.doValueIteration(backup, epsilon, maxSweeps, policyPatience, prune = prune, initialValues = initialValues.ravel())
+
+        directory = os.path.dirname(solvePath)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        partialPath = solvePath + '.' + str(os.getpid()) + '.part'
+        with open(partialPath, 'wb') as f:
+            np.savez(f, track = self.track, crashReset = self.crashReset, start = np.array(self.startingCells[0]),
+                     nextStateTable = np.asarray(self.nextStateTable), finishStates = np.asarray(self.finishStates),
+                     values = self.valIterStates.reshape(-1, 9).max(axis = 1))
+        os.replace(partialPath, solvePath) # an interrupted run leaves the last complete solve in place
+        return
+
+    def doDualValueIteration(self, partner, epsilon = 1e-6, maxSweeps = 98):
+        # solves this track and partner (same grid, other crash mode) together with the expected-value backup of the
+        # 'sparse' mode. The ray traces are shared (compileTransitions with a partner, or both tracks' caches), and so
+        # is one next-state table: partner only keeps its own targets for the (state, action) pairs whose outcome
+        # depends on the crash mode. The 0.2 failure outcome is the same for every action, so a sweep only needs V:
+        # V(s) = -1 + DISCOUNT * (0.8 * max over a of V(next(s, a)) + 0.2 * V(next(s, (0, 0)))).
+        # Both modes' V sit side by side, [flat state][mode], and are read as one complex number per state, so each
+        # action of a sweep is one gather over the shared table for both modes. A mode whose largest change in V is at
+        # most epsilon drops out, the other one is then swept alone. Each track ends up with its own valIterStates
+        # (the Q values of its final V), sweep count and path.
+        tracks = [self, partner]
+        self.compileTransitions(partner)
+        numStates = self.trackSize * 121
+        ownNext = np.asarray(self.nextStateTable)
+        partnerNext = np.asarray(partner.nextStateTable)
+        actionNext = np.ascontiguousarray(ownNext.T) # [action][flat state], so each gather reads one contiguous row
+        crashMoves = [] # (states, partner's next states) of every action, where the crash mode changes the outcome
+        for action in range(9):
+            states = np.flatnonzero(ownNext[:, action] != partnerNext[:, action])
+            crashMoves.append((states, partnerNext[states, action]))
+        terminalStates = np.asarray(self.getTerminalStates())
+        values = np.zeros((numStates, 2), dtype = self.valueDtype) # [flat state][mode]
+        pairDtype = np.complex64 if (values.dtype == np.float32) else np.complex128 # both modes of a state in one item
+        for track in tracks:
+            track.residuals = []
+            track.sweepCount = 0
+        activeModes = [0, 1] # a mode is no longer swept once its residual is at most epsilon
+        while activeModes and (max(track.sweepCount for track in tracks) < maxSweeps):
+            print("k: " + str(max(track.sweepCount for track in tracks) + 2))
+            if (len(activeModes) == 2):
+                source = values.view(pairDtype).reshape(numStates)
+            else:
+                source = np.ascontiguousarray(values[:, activeModes[0]])
+            bestItems = np.empty(numStates, dtype = source.dtype)
+            gatheredItems = np.empty(numStates, dtype = source.dtype)
+            bestValues = bestItems.view(self.valueDtype).reshape(numStates, len(activeModes)) # [flat state][active mode]
+            gatheredValues = gatheredItems.view(self.valueDtype).reshape(numStates, len(activeModes))
+            for action in range(9):
+                if (action == 0):
+                    np.take(source, actionNext[action], out = bestItems)
+                    gathered = bestValues
+                else:
+                    np.take(source, actionNext[action], out = gatheredItems)
+                    gathered = gatheredValues
+                if (activeModes[-1] == 1):
+                    states, targets = crashMoves[action]
+                    gathered[states, -1] = values[targets, 1]
+                if (action == 4):
+                    failValues = gathered.copy() # acceleration (0, 0)
+                if (action > 0):
+                    np.maximum(bestValues, gatheredValues, out = bestValues)
+            newValues = expectedBackup(bestValues, failValues)
+            newValues[terminalStates] = 0.0
+            residuals = np.abs(newValues - values[:, activeModes]).max(axis = 0)
+            values[:, activeModes] = newValues
+            for mode, residual in zip(list(activeModes), residuals.tolist()):
+                tracks[mode].residuals.append(residual)
+                tracks[mode].sweepCount += 1
+                tracks[mode].opCount += numStates * 9
+                if (residual <= epsilon):
+                    activeModes.remove(mode)
+        print("Sweeps: " + str([track.sweepCount for track in tracks]) + ", final residuals: " + str([track.residuals[-1] for track in tracks]))
+        for mode, (track, nextStates) in enumerate(zip(tracks, (ownNext, partnerNext))):
+            track.allocateValueTables()
+            modeValues = np.ascontiguousarray(values[:, mode])
+            qValues = expectedBackup(modeValues[nextStates], modeValues[nextStates[:, 4]][:, None])
+            qValues[terminalStates] = 0.0
+            track.valIterStates.reshape(-1, 9)[:] = qValues
+            track.extractBestPath()
+        return
+
     def doIterationK0(self):
         locIndex = 0
         for loc in self.valIterStates:
-            xy = self.trackIDs[locIndex]
+            xy = self.trackCoords[locIndex]
             xpos = xy[0]
             ypos = xy[1]
             if (self.track[xpos][ypos] != 2):   
@@ -353,7 +1149,7 @@ class Track:
     def doIterationK1(self):
         locIndex = 0
         for loc in self.valIterStates:
-            xy = self.trackIDs[locIndex]
+            xy = self.trackCoords[locIndex]
             xpos = xy[0]
             ypos = xy[1]
             xvelVal = -5
@@ -384,7 +1180,7 @@ class Track:
         # for 20% chance of failure
         locIndex = 0
         for loc in self.valIterStates:
-            xy = self.trackIDs[locIndex]
+            xy = self.trackCoords[locIndex]
             xpos = xy[0]
             ypos = xy[1]
             xvelVal = -5
@@ -414,6 +1210,26 @@ class Track:
                 xvelVal += 1
             locIndex += 1 
         return
+
+    def doIterationK0Vectorized(self):
+        # same as doIterationK0: every state not on the finish line starts at -1
+        onFinish = self.track[self.trackCoords[:, 0], self.trackCoords[:, 1]] == 2
+        self.valIterStates[~onFinish] = -1.0
+        self.opCount += int((~onFinish).sum()) * 1089
+        return
+
+    def doIterationK1Vectorized(self):
+        # same as doIterationK1, with the transition table compiled in bulk instead of one attemptFinish per move
+        # (unless a table is already there, e.g. from the cache or compileTransitionsIncremental)
+        if self.nextStateTable is None:
+            self.compileTransitions()
+        values = self.valIterStates.reshape(-1, 9)
+        values[~self.finishStates] += -0.999 * 0.8
+        # for 20% chance of failure. doIterationK1 tests this with acceleration values (1, 1) (action index 8), so the
+        # same is used here
+        values[~self.finishStates[:, 8]] += -0.999 * 0.2
+        self.opCount += 2 * self.trackSize * 1089
+        return
         
     def doIterationKn(self, k):
         valueRemoved = -(0.999**k)
@@ -427,7 +1243,7 @@ class Track:
         locIndex = 0
         for loc in self.valIterStates:
             #print("locIndex: " + str(locIndex))
-            xy = self.trackIDs[locIndex]
+            xy = self.trackCoords[locIndex]
             xpos = xy[0]
             ypos = xy[1]
             xvelVal = -5
@@ -464,7 +1280,7 @@ class Track:
         locIndex = 0
         for loc in self.valIterStates:
             #print("locIndex: " + str(locIndex))
-            xy = self.trackIDs[locIndex]
+            xy = self.trackCoords[locIndex]
             xpos = xy[0]
             ypos = xy[1]
             xvelVal = -5
@@ -500,15 +1316,477 @@ class Track:
         if pathFound1 and pathFound2:
             valueUpdated = False
         return valueUpdated
+
+    def doIterationKnVectorized(self, k):
+        # same sweep as doIterationKn, done with array operations instead of five nested loops.
+        # doIterationKn updates self.valIterStates in place, so a state visited later in a sweep can see a value
+        # that was already lowered earlier in that same sweep. To give identical results, each pass below starts from
+        # the plain (previous sweep) backup, then re-reads the values lowered so far until the decrements stop changing.
+        # Decrements only ever grow, and every repeat fixes at least the next state in visiting order, so this ends.
+        valueRemoved = -(0.999**k)
+        kMinus2Value = 0
+        for i in range(k - 1):
+            kMinus2Value += -(1 * (0.999**i))
+
+        numStates = self.trackSize * 121 # every (trackID, x velocity, y velocity)
+        values = self.valIterStates.reshape(numStates, 9) # view, so writes go straight to self.valIterStates
+        nextStates = self.nextStateTable # flat next state for every (state, acceleration)
+        stateIndex = np.arange(numStates)
+
+        # first pass: chosen acceleration (0.8)
+        oldValues = values.copy()
+        oldMax = oldValues.max(axis = 1)
+        # a state that leads back to itself has only seen the updates of the accelerations visited before this one
+        oldSuffixMax = np.maximum.accumulate(oldValues[:, ::-1], axis = 1)[:, ::-1]
+        visitedBefore = nextStates < stateIndex[:, None]
+        leadsToSelf = nextStates == stateIndex[:, None]
+        removed1 = np.zeros((numStates, 9), dtype = bool)
+        while True:
+            newValues = np.where(removed1, oldValues + valueRemoved * 0.8, oldValues)
+            newPrefixMax = np.full((numStates, 9), -np.inf)
+            newPrefixMax[:, 1:] = np.maximum.accumulate(newValues[:, :-1], axis = 1)
+            nextValue = np.where(visitedBefore, newValues.max(axis = 1)[nextStates], oldMax[nextStates])
+            nextValue = np.where(leadsToSelf, np.maximum(newPrefixMax, oldSuffixMax), nextValue)
+            improves = (nextValue >= kMinus2Value)
+            if np.array_equal(~improves, removed1):
+                break
+            removed1 = ~improves
+        values[:] = newValues
+        self.opCount += numStates * 9
+
+        # the loop version checks start cells with zero velocity for a found path
+        startIDs = [int(self.trackIndex[cell]) for cell in self.startingCells]
+        pathFound1 = bool(improves.reshape(self.trackSize, 11, 11, 9)[startIDs, 5, 5].any())
+        pathFound2 = False # doIterationKn only sets this inside its 'not improves' branch, so it never fires
+
+        # for 20% chance of failure (same zero-acceleration outcome for every action of a state)
+        oldValues = values.copy()
+        oldMax = oldValues.max(axis = 1)
+        failStates = nextStates[:, 4]
+        visitedBefore = failStates < stateIndex
+        removed2 = np.zeros(numStates, dtype = bool)
+        while True:
+            newValues = np.where(removed2[:, None], oldValues + valueRemoved * 0.2, oldValues)
+            nextValue = np.where(visitedBefore, newValues.max(axis = 1)[failStates], oldMax[failStates])
+            improves = (nextValue >= kMinus2Value)
+            if np.array_equal(~improves, removed2):
+                break
+            removed2 = ~improves
+        values[:] = newValues
+        self.opCount += 3 * int(removed2.sum())
+
+        valueUpdated = bool(removed1.any() or removed2.any())
+        if pathFound1 and pathFound2:
+            valueUpdated = False
+        return valueUpdated
+
+    def doIterationSparse(self):
+        # one Bellman sweep: Q(s, a) = reward + DISCOUNT * (0.8 * V(success) + 0.2 * V(failure)), V(s) = max over a of Q(s, a).
+        # finish states keep V = 0, so a move that reaches the line is only charged its own cost.
+        numModelStates = self.qTable.shape[0] # stateValues may have the pruning sentinel after these
+        qValues = self.rewardVector + DISCOUNT * (self.transitionMatrix @ self.stateValues)
+        qValues = qValues.reshape(-1, 9)
+        newValues = np.where(self.terminalStates, 0.0, qValues.max(axis = 1))
+        self.qTable[:] = np.where(self.terminalStates[:, None], 0.0, qValues)
+        self.opCount += qValues.size
+        valueUpdated = not np.array_equal(newValues, self.stateValues[:numModelStates])
+        self.stateValues[:numModelStates] = newValues
+        return valueUpdated
+
+    def startParallelSweeps(self, workers = None):
+        # moves the compiled model into shared memory and starts the worker pool for doIterationParallel.
+        # Workers only synchronise at sweep boundaries (one pool.starmap per sweep). If this fails part way,
+        # stopParallelSweeps frees whatever was already created.
+        if workers is None:
+            workers = os.cpu_count() or 1
+        numModelStates = self.nextStates.shape[0]
+        specs = {}
+        for name, shape, dtype in (('nextStates', self.nextStates.shape, self.nextStates.dtype),
+                                   ('terminalStates', self.terminalStates.shape, bool),
+                                   ('values', (2, self.stateValues.size), self.valueDtype),
+                                   ('qTable', self.qTable.shape, self.valueDtype)):
+            block = shared_memory.SharedMemory(create = True, size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+            self.sharedBlocks.append(block)
+            specs[name] = (block.name, shape, dtype)
+        bounds = np.linspace(0, numModelStates, min(workers, numModelStates) + 1).astype(int)
+        self.shards = [(int(bounds[i]), int(bounds[i + 1])) for i in range(len(bounds) - 1)]
+        self.sweepPool = multiprocessing.Pool(workers, initializer = attachSharedTables, initargs = (specs,))
+
+        # arrays on the blocks are only made once nothing else can fail, a block cannot be closed while one exists
+        tables = {name: np.ndarray(shape, dtype = dtype, buffer = block.buf)
+                  for (name, (_, shape, dtype)), block in zip(specs.items(), self.sharedBlocks)}
+        tables['nextStates'][:] = self.nextStates
+        tables['terminalStates'][:] = self.terminalStates
+        tables['values'][:] = self.stateValues # both buffers start equal (this also copies the pruning sentinel)
+        tables['qTable'][:] = self.qTable
+        self.sharedValues = tables['values']
+        self.qTable = tables['qTable'] # the convergence checks in doValueIteration read the shared table directly
+        self.readBuffer = 0
+        return
+
+    def doIterationParallel(self):
+        # one Jacobi sweep (same backup as doIterationSparse), every shard handled by one worker
+        results = self.sweepPool.starmap(sweepShard, [(start, end, self.readBuffer) for start, end in self.shards])
+        self.readBuffer = 1 - self.readBuffer
+        self.lastResidual = max((residual for _, residual in results), default = 0.0) # no shards for an empty model
+        self.opCount += self.qTable.size
+        return any(changed for changed, _ in results)
+
+    def stopParallelSweeps(self):
+        # copies the results out of shared memory, then shuts the pool down and frees the blocks. Also called after a
+        # failed start or sweep, so it only undoes what exists
+        if self.sharedValues is not None:
+            self.stateValues = self.sharedValues[self.readBuffer].copy()
+            self.qTable = self.qTable.copy()
+            self.sharedValues = None
+        if self.sweepPool is not None:
+            self.sweepPool.close()
+            self.sweepPool.join()
+            self.sweepPool = None
+        for block in self.sharedBlocks:
+            block.close()
+            block.unlink()
+        self.sharedBlocks = []
+        return
+
+    def doIterationBlocked(self):
+        # one Jacobi sweep (same backup as doIterationSparse) a block of states at a time, so memory mapped tables
+        # are read and written front to back. Reads the previous sweep's values and writes the other buffer.
+        numStates = self.qTable.shape[0]
+        blockSize = numStates if self.blockSize is None else self.blockSize
+        values = self.blockValues[self.readBuffer]
+        newValues = self.blockValues[1 - self.readBuffer]
+        valueUpdated = False
+        self.lastResidual = 0.0
+        for start in range(0, numStates, blockSize):
+            end = min(start + blockSize, numStates)
+            nextStates = np.asarray(self.nextStates[start:end])
+            qValues = expectedBackup(values[nextStates], values[nextStates[:, 4]][:, None])
+            qValues[np.asarray(self.terminalStates[start:end])] = 0.0
+            self.lastResidual = max(self.lastResidual, float(np.max(np.abs(qValues - self.qTable[start:end]))))
+            self.qTable[start:end] = qValues
+            newValues[start:end] = qValues.max(axis = 1)
+            valueUpdated = valueUpdated or bool((newValues[start:end] != values[start:end]).any())
+        self.readBuffer = 1 - self.readBuffer
+        self.opCount += numStates * 9
+        return valueUpdated
+
+    def allocateValueTables(self, loopBackup = False):
+        # value tables are only created once a solver that needs them runs, so Q-learning and SARSA never pay for them.
+        # the python loop backup also needs the old per-move resultingStates table.
+        if self.valIterStates is None:
+            self.valIterStates = self.createTable('valIterStates', (self.trackSize, 11, 11, 3, 3), self.valueDtype)
+        if loopBackup and (self.resultingStates is None):
+            self.resultingStates = self.createTable('resultingStates', (self.trackSize, 11, 11, 3, 3, 3), np.int32)
+        return
+
+    def storeQTable(self):
+        # copies the solved self.qTable into valIterStates, which path extraction reads. States removed by
+        # pruneStates get the value of never finishing.
+        values = self.valIterStates.reshape(-1, 9)
+        if self.activeStates is None:
+            values[:] = self.qTable
+        else:
+            values[:] = NEVER_FINISH_VALUE
+            values[self.activeStates] = self.qTable
+        return
+
+    def backupStates(self, states):
+        # expected-value backup (same as doIterationSparse) for the given flat states only, written in place
+        successValues = self.stateValues[self.nextStates[states]]
+        failValues = self.stateValues[self.nextStates[states, 4]]
+        qValues = expectedBackup(successValues, failValues[:, None])
+        qValues[self.terminalStates[states]] = 0.0
+        newValues = qValues.max(axis = 1)
+        change = np.abs(newValues - self.stateValues[states])
+        self.stateValues[states] = newValues
+        self.qTable[states] = qValues
+        self.opCount += qValues.size
+        return change
+
+    def doIterationGaussSeidel(self, prioritized = False, threshold = 0.0):
+        # one in-place sweep over self.sweepLayers. States within a layer are backed up together, each layer
+        # already uses the values its closer layers got in this sweep.
+        valueUpdated = False
+        changed = np.zeros(self.qTable.shape[0], dtype = bool)
+        for layer in self.sweepLayers:
+            if self.prioritySelection is not None:
+                layer = layer[self.prioritySelection[layer]]
+                if (layer.size == 0):
+                    continue
+            change = self.backupStates(layer)
+            changed[layer] = change > threshold
+            valueUpdated = valueUpdated or bool((change > 0).any())
+
+        if prioritized:
+            # next sweep only revisits states that can move into a state that changed noticeably
+            self.prioritySelection = (self.predecessorMatrix.T @ changed.astype(float)) > 0
+            valueUpdated = bool(self.prioritySelection.any())
+        return valueUpdated
         
     # ------------------------ END DO VALUE ITERATION ---------------------------------
 
     # ************************** END VALUE ITERATION METHODS *******************************
 
 
+    # ************************** POLICY ITERATION METHODS *******************************
+    # ------------------------ DO POLICY ITERATION ---------------------------------
+    def doPolicyIteration(self, prune = False, linearSolver = 'direct', maxIterations = 100):
+        # alternative to doValueIteration on the same compiled model (compileMDP): evaluate the current policy exactly,
+        # then switch every state to its best action under those values, until the policy stops changing.
+        # linearSolver is 'direct' (sparse LU) or 'krylov' (bicgstab, warm started from the last values), anything else
+        # raises ValueError. self.sweepCount counts the policy evaluations.
+        if linearSolver not in ('direct', 'krylov'):
+            raise ValueError("unknown linear solver " + repr(linearSolver) + ", expected 'direct' or 'krylov'")
+        self.compileMDP()
+        if prune:
+            self.pruneStates()
+        numModelStates = self.nextStates.shape[0]
+        self.stateValues = np.zeros(self.transitionMatrix.shape[1], dtype = self.valueDtype)
+        if self.activeStates is not None:
+            self.stateValues[-1] = NEVER_FINISH_VALUE # sentinel
+        stateIndex = np.arange(numModelStates)
+        policy = np.full(numModelStates, 4) # start by never accelerating (action index 4 is (0, 0))
+
+        self.sweepCount = 0
+        policyStable = False
+        while not policyStable and (self.sweepCount < maxIterations):
+            print("policy iteration: " + str(self.sweepCount))
+            self.evaluatePolicy(policy, linearSolver)
+            self.sweepCount += 1
+
+            # improvement: best action under the evaluated values, keeping the current one on ties so the policy
+            # cannot keep switching between equally good accelerations
+            qValues = (self.rewardVector + DISCOUNT * (self.transitionMatrix @ self.stateValues)).reshape(-1, 9)
+            qValues[self.terminalStates] = 0.0
+            self.opCount += qValues.size
+            improves = qValues.max(axis = 1) > qValues[stateIndex, policy] + 1e-9
+            newPolicy = np.where(improves, qValues.argmax(axis = 1), policy)
+            policyStable = np.array_equal(newPolicy, policy)
+            policy = newPolicy
+
+        self.qTable = qValues.astype(self.valueDtype)
+        self.allocateValueTables()
+        self.storeQTable()
+        self.extractBestPath()
+        return
+
+    def evaluatePolicy(self, policy, linearSolver = 'direct'):
+        # solves V = r + DISCOUNT * P_policy V for the model states (finish states fixed at 0) into self.stateValues
+        numModelStates = self.nextStates.shape[0]
+        rows = np.arange(numModelStates) * 9 + policy
+        policyMatrix = self.transitionMatrix[rows]
+        rewards = self.rewardVector[rows].copy()
+        if (self.transitionMatrix.shape[1] > numModelStates):
+            # the pruning sentinel has a fixed value, so its column moves to the right hand side
+            rewards += DISCOUNT * policyMatrix[:, numModelStates].toarray().ravel() * self.stateValues[-1]
+            policyMatrix = policyMatrix[:, :numModelStates]
+            rewards[self.terminalStates] = 0.0
+        notFinished = sparse.diags((~self.terminalStates).astype(float)) # the race ends on 'F'
+        system = (sparse.identity(numModelStates, format = 'csr') - DISCOUNT * (notFinished @ policyMatrix)).tocsc()
+        if (linearSolver == 'krylov'):
+            values, info = sparseLinalg.bicgstab(system, rewards, x0 = self.stateValues[:numModelStates], rtol = 1e-10, atol = 1e-10)
+            if (info != 0):
+                print("bicgstab did not converge, solving directly")
+                values = sparseLinalg.spsolve(system, rewards)
+        else:
+            values = sparseLinalg.spsolve(system, rewards)
+        self.stateValues[:numModelStates] = values
+        self.opCount += system.nnz
+        return
+    # ------------------------ END DO POLICY ITERATION ---------------------------------
+
+    # ************************** END POLICY ITERATION METHODS *******************************
+
+
+    # ************************** SHORTEST PATH METHODS *******************************
+    # ------------------------ DO SHORTEST PATH ---------------------------------
+    def doShortestPath(self):
+        # exact fewest-moves race when every acceleration works (no 0.2 failure). Breadth first search over flat states
+        # (trackID * 121 + (vx + 5) * 11 + (vy + 5)) from every start cell at zero velocity, a whole layer of moves at a
+        # time through the compiled nextStateTable / finishStates (compileTransitions, or the cache), so no value tables
+        # are built. The first layer holding a move onto 'F' gives the fewest moves, parent links give the path.
+        if self.nextStateTable is None:
+            self.compileTransitions()
+        numStates = self.trackSize * 121
+        parents = np.full(numStates, -1, dtype = self.stateDtype) # state every state was first reached from
+        frontier = np.unique(self.trackIndex[tuple(np.array(self.startingCells).T)] * 121 + 60) # 60 is velocity (0, 0)
+        parents[frontier] = frontier # a start is its own parent
+
+        self.bestPath = []
+        self.bestMoves = 9999
+        goal = None
+        while frontier.size > 0:
+            nextStates = np.asarray(self.nextStateTable[frontier])
+            finishes = np.asarray(self.finishStates[frontier])
+            self.opCount += nextStates.size
+            if finishes.any():
+                row, action = np.argwhere(finishes)[0]
+                goal = (int(nextStates[row, action]), int(frontier[row])) # finish state and the state it was reached from
+                break
+            reached = nextStates.ravel()
+            fromStates = np.repeat(frontier, 9)
+            unseen = parents[reached] == -1
+            frontier, first = np.unique(reached[unseen], return_index = True)
+            parents[frontier] = fromStates[unseen][first]
+
+        if goal is None:
+            print("no path to the finish line")
+            return
+        finishState, state = goal
+        path = [finishState]
+        while True:
+            path.append(state)
+            if (parents[state] == state):
+                break
+            state = int(parents[state])
+        cells = self.trackCoords[np.array(path[::-1]) // 121]
+        self.bestPath = [[int(row), int(col)] for row, col in cells]
+        self.bestMoves = len(self.bestPath) - 1
+        return
+    # ------------------------ END DO SHORTEST PATH ---------------------------------
+
+    # ************************** END SHORTEST PATH METHODS *******************************
+
+
+    # ************************** RTDP METHODS *******************************
+    # ------------------------ DO RTDP ---------------------------------
+    def doRTDP(self, epsilon = 1e-4, maxTrials = 10000, maxSteps = 1000, labeled = True, seed = None):
+        # real-time dynamic programming: instead of sweeping every state, run greedy trials from the start cells and
+        # back up only the states visited, with the same 0.8 / 0.2 expected-value backup as the sparse value iteration.
+        # Moves are simulated on demand and cached, values start from an optimistic estimate (the discounted cost of
+        # the fewest moves the finish distance allows, see doShortestPath), so states off the good routes are never
+        # touched. With labeled, a state is marked solved once every state its greedy policy can reach has a residual
+        # below epsilon (Bonet and Geffner's labeled RTDP), and trials stop when every start state is solved.
+        # Start states and acceleration failures of the trials are drawn from a RandomStream of seed, like the learners.
+        # Its python backups cost far more per state than a sweep, so it only beats value iteration on large tracks
+        # where the good routes cover a small part of the grid (a big open area around a nearby start and finish).
+        # On tracks the route winds through, like the provided ones, the sparse value iteration is faster.
+        nextUniform = RandomStream(seed).uniform
+        distance = self.getFinishDistanceGrid()
+        successors = {} # state -> the 9 states its accelerations lead to
+        values = {}
+        solved = set()
+
+        def getSuccessors(state):
+            if state not in successors:
+                successors[state] = [self.simulateMove(state, xaccVal, yaccVal) for xaccVal in range(-1, 2) for yaccVal in range(-1, 2)]
+            return successors[state]
+
+        def getValue(state):
+            if state not in values:
+                if (self.track[state[0]][state[1]] == 2):
+                    values[state] = 0.0
+                else:
+                    moves = -(-int(distance[state[0]][state[1]]) // 5)
+                    if self.crashReset:
+                        moves = min(moves, 1 + -(-int(distance[self.startingCells[0][0]][self.startingCells[0][1]]) // 5))
+                    values[state] = -(1 - DISCOUNT**moves) / (1 - DISCOUNT)
+            return values[state]
+
+        def getQValues(state):
+            nextStates = getSuccessors(state)
+            failValue = getValue(nextStates[4]) # acceleration (0, 0)
+            self.opCount += 9
+            return [expectedBackup(getValue(nextState), failValue) for nextState in nextStates]
+
+        def backup(state):
+            # returns the greedy action index and the change in value
+            qValues = getQValues(state)
+            action = int(np.argmax(qValues))
+            residual = abs(qValues[action] - getValue(state))
+            values[state] = qValues[action]
+            return action, residual
+
+        def isTerminal(state):
+            return self.track[state[0]][state[1]] == 2
+
+        def checkSolved(state):
+            # labels every state the greedy policy reaches from state as solved if all of them have converged
+            converged = True
+            stack = [state]
+            closed = []
+            seen = {state}
+            while stack:
+                current = stack.pop()
+                closed.append(current)
+                if isTerminal(current):
+                    continue
+                qValues = getQValues(current)
+                action = int(np.argmax(qValues))
+                if (abs(qValues[action] - getValue(current)) > epsilon):
+                    converged = False
+                    continue
+                for nextState in (getSuccessors(current)[action], getSuccessors(current)[4]):
+                    if (nextState not in solved) and (nextState not in seen):
+                        seen.add(nextState)
+                        stack.append(nextState)
+            if converged:
+                solved.update(closed)
+            else:
+                for current in reversed(closed):
+                    if not isTerminal(current):
+                        backup(current)
+            return converged
+
+        startStates = [(cell[0], cell[1], 0, 0) for cell in self.startingCells]
+        trials = 0
+        while (trials < maxTrials) and not (labeled and all(state in solved for state in startStates)):
+            state = startStates[int(nextUniform() * len(startStates))]
+            visited = []
+            for _step in range(maxSteps):
+                if isTerminal(state) or (labeled and (state in solved)):
+                    break
+                visited.append(state)
+                action, residual = backup(state)
+                if (nextUniform() < FAIL_PROBABILITY):
+                    action = 4 # the acceleration failed
+                state = getSuccessors(state)[action]
+            if labeled:
+                while visited and checkSolved(visited.pop()):
+                    pass
+            trials += 1
+        self.sweepCount = trials
+        print("RTDP trials: " + str(trials) + ", states touched: " + str(len(values)) + " of " + str(self.trackSize * 121))
+
+        # greedy path with every acceleration succeeding, from the best start state
+        bestStart = max(startStates, key = getValue)
+        state = bestStart
+        self.bestPath = [[state[0], state[1]]]
+        self.bestMoves = 0
+        while (not isTerminal(state)) and (self.bestMoves < maxSteps):
+            qValues = getQValues(state)
+            state = getSuccessors(state)[int(np.argmax(qValues))]
+            self.bestPath.append([state[0], state[1]])
+            self.bestMoves += 1
+        return
+    # ------------------------ END DO RTDP ---------------------------------
+
+    # ************************** END RTDP METHODS *******************************
+
+
     # ************************** Q-LEARNING METHODS *******************************
     # ------------------------ DO Q-LEARNING ---------------------------------
-    def doQLearning(self):
+    def doQLearning(self, kernel = 'loop', seed = None, replay = None):
+        # kernel 'loop' simulates every step with the car (below), 'flat' runs the same training on the compiled
+        # transition tables (trainQTable), which is much faster. All randomness comes from a RandomStream of seed,
+        # so a seeded run can be repeated exactly. replay 'uniform' or 'prioritized' trains the flat kernel from
+        # minibatches of a ReplayBuffer of past moves sampled that way. Any other kernel or replay raises ValueError.
+        if kernel not in ('loop', 'flat'):
+            raise ValueError("unknown learning kernel " + repr(kernel) + ", expected 'loop' or 'flat'")
+        if replay not in (None, 'uniform', 'prioritized'):
+            raise ValueError("unknown replay " + repr(replay) + ", expected None, 'uniform' or 'prioritized'")
+        randomStream = RandomStream(seed)
+        nextUniform = randomStream.uniform
+        if (kernel == 'flat') or (replay is not None):
+            self.qVals = np.zeros((self.trackSize * 121, 9))
+            replayBuffer = None
+            if replay is not None:
+                replayBuffer = ReplayBuffer(prioritized = (replay == 'prioritized'), seed = randomStream.generator)
+            self.trainQTable(self.qVals, randomStream = randomStream, replay = replayBuffer)
+            self.evaluateQTable(self.qVals, randomStream = randomStream)
+            return
+
         # q table with one value for every state or action...
         # state is just track ID, vs, vy. action is just ax, ay
         qVals = np.zeros((self.trackSize, 11, 11, 3, 3), dtype=float)
@@ -531,7 +1809,7 @@ class Track:
 
         # get index for the current state
         def getStateIndex():
-            trackID = self.trackLocs[(int(self.position[0]), int(self.position[1]))]
+            trackID = int(self.trackIndex[self.position[0], self.position[1]])
             vxIDX = self.velocity[0] + 5
             vyIDX = self.velocity[1] + 5
             return trackID, vxIDX, vyIDX
@@ -543,14 +1821,14 @@ class Track:
 
         # choose action explore or exploit
         def chooseAction(trackID, vxIDX, vyIDX, eps):
-            if random.random() < eps:
+            if nextUniform() < eps:
                 # random action
-                return random.choice(accelerations)
+                return accelerations[int(nextUniform() * 9)]
             # greedy action
             qSlice = qVals[trackID, vxIDX, vyIDX]
             qMax = np.max(qSlice)
             bestIndex = np.argwhere(qSlice == qMax)
-            idx = random.choice(bestIndex)
+            idx = bestIndex[int(nextUniform() * len(bestIndex))]
             axIDX = int(idx[0])
             ayIDX = int(idx[1])
             return axIDX - 1, ayIDX - 1
@@ -566,7 +1844,7 @@ class Track:
             self.acceleration[1] = ay
 
             # 20 percent chance the acceleration fails (as required)
-            if random.random() < 0.2:
+            if nextUniform() < FAIL_PROBABILITY:
                 self.acceleration[0] = 0
                 self.acceleration[1] = 0
 
@@ -603,11 +1881,7 @@ class Track:
             self.acceleration[0] = ax
             self.acceleration[1] = ay
 
-            # REMOVED for coding XX
-            # if random.random() < 0.2:
-            #     self.acceleration[0] = 0
-            #     self.acceleration[1] = 0
-    
+            # evaluation runs have no acceleration failures
             self.updateVelocity()
             self.updatePosition()
 
@@ -629,16 +1903,16 @@ class Track:
             #   goal based exploring starts
             if goal_zone_ids and ep < int(0.5 * episodeNumber):
                 # first .5 of training start near goal
-                if random.random() < 0.7:
+                if nextUniform() < 0.7:
                     # .7 of the time start in goal zone
-                    randID = random.choice(goal_zone_ids)
+                    randID = goal_zone_ids[int(nextUniform() * len(goal_zone_ids))]
                 else:
-                    randID = random.randrange(self.trackSize)
+                    randID = int(nextUniform() * self.trackSize)
             else:
                 # after uniform over over no wall states
-                randID = random.randrange(self.trackSize)
+                randID = int(nextUniform() * self.trackSize)
 
-            start = self.trackIDs[randID]
+            start = self.trackCoords[randID]
 
             self.position[0] = start[0]
             self.position[1] = start[1]
@@ -684,6 +1958,8 @@ class Track:
             if randomStart > randomMin:
                 randomStart *= randomDecay
 
+        self.qVals = qVals.reshape(-1, 9)
+
         # run w no exploration for bestPath and bestMoves
         maxSteps = 500
         bestLength = None
@@ -706,7 +1982,7 @@ class Track:
                 qSlice = qVals[trackID, vxIDX, vyIDX]
                 qMax = np.max(qSlice)
                 bestIndex = np.argwhere(qSlice == qMax)
-                idx = random.choice(bestIndex)
+                idx = bestIndex[int(nextUniform() * len(bestIndex))]
                 axIDX = int(idx[0])
                 ayIDX = int(idx[1])
                 action = (axIDX - 1, ayIDX - 1)
@@ -738,7 +2014,7 @@ class Track:
                 qSlice = qVals[trackID, vxIDX, vyIDX]
                 qMax = np.max(qSlice)
                 bestIndex = np.argwhere(qSlice == qMax)
-                idx = random.choice(bestIndex)
+                idx = bestIndex[int(nextUniform() * len(bestIndex))]
                 axIDX = int(idx[0])
                 ayIDX = int(idx[1])
                 action = (axIDX - 1, ayIDX - 1)
@@ -762,7 +2038,18 @@ class Track:
 
     # ************************** SARSA METHODS *******************************
     # ------------------------ DO SARSA ---------------------------------
-    def doSARSA(self):
+    def doSARSA(self, kernel = 'loop', seed = None):
+        # kernel and seed as in doQLearning
+        if kernel not in ('loop', 'flat'):
+            raise ValueError("unknown learning kernel " + repr(kernel) + ", expected 'loop' or 'flat'")
+        randomStream = RandomStream(seed)
+        nextUniform = randomStream.uniform
+        if (kernel == 'flat'):
+            self.qVals = np.zeros((self.trackSize * 121, 9))
+            self.trainQTable(self.qVals, sarsa = True, randomStream = randomStream)
+            self.evaluateQTable(self.qVals, randomStream = randomStream)
+            return
+
         # q table with one value for every state or action...
         qVals = np.zeros((self.trackSize, 11, 11, 3, 3), dtype=float)
 
@@ -784,7 +2071,7 @@ class Track:
 
         # get index for the current state
         def getStateIndex():
-            trackID = self.trackLocs[(int(self.position[0]), int(self.position[1]))]
+            trackID = int(self.trackIndex[self.position[0], self.position[1]])
             vxIDX = self.velocity[0] + 5
             vyIDX = self.velocity[1] + 5
             return trackID, vxIDX, vyIDX
@@ -796,12 +2083,12 @@ class Track:
 
         # choose action explore or exploit
         def chooseAction(trackID, vxIDX, vyIDX, eps):
-            if random.random() < eps:
-                return random.choice(actions)
+            if nextUniform() < eps:
+                return actions[int(nextUniform() * 9)]
             qSlice = qVals[trackID, vxIDX, vyIDX]
             qMax = np.max(qSlice)
             bestIndex = np.argwhere(qSlice == qMax)
-            idx = random.choice(bestIndex)
+            idx = bestIndex[int(nextUniform() * len(bestIndex))]
             axIDX = int(idx[0])
             ayIDX = int(idx[1])
             return axIDX - 1, ayIDX - 1
@@ -816,7 +2103,7 @@ class Track:
             self.acceleration[1] = ay
 
             # .2 chance accel fails (proj specs)
-            if random.random() < 0.2:
+            if nextUniform() < FAIL_PROBABILITY:
                 self.acceleration[0] = 0
                 self.acceleration[1] = 0
 
@@ -852,11 +2139,7 @@ class Track:
             self.acceleration[0] = ax
             self.acceleration[1] = ay
 
-            # .2 accel fails, assignment specs commented for coding XX
-           # if random.random() < 0.2:
-           #     self.acceleration[0] = 0
-           #     self.acceleration[1] = 0
-
+            # evaluation runs have no acceleration failures
             self.updateVelocity()
             self.updatePosition()
 
@@ -875,14 +2158,14 @@ class Track:
         for ep in range(episodeNumber):
 
             if goal_zone_ids and ep < int(0.5 * episodeNumber):
-                if random.random() < 0.7:
-                    randID = random.choice(goal_zone_ids)
+                if nextUniform() < 0.7:
+                    randID = goal_zone_ids[int(nextUniform() * len(goal_zone_ids))]
                 else:
-                    randID = random.randrange(self.trackSize)
+                    randID = int(nextUniform() * self.trackSize)
             else:
-                randID = random.randrange(self.trackSize)
+                randID = int(nextUniform() * self.trackSize)
 
-            start = self.trackIDs[randID]
+            start = self.trackCoords[randID]
 
             self.position[0] = start[0]
             self.position[1] = start[1]
@@ -926,6 +2209,8 @@ class Track:
             if randomStart > randomMin:
                 randomStart *= randomDecay
 
+        self.qVals = qVals.reshape(-1, 9)
+
         # test created policy with greedy sims
         maxSteps = 500
         bestLength = None
@@ -947,7 +2232,7 @@ class Track:
                 qSlice = qVals[trackID, vxIDX, vyIDX]
                 qMax = np.max(qSlice)
                 bestIndex = np.argwhere(qSlice == qMax)
-                idx = random.choice(bestIndex)
+                idx = bestIndex[int(nextUniform() * len(bestIndex))]
                 axIDX = int(idx[0])
                 ayIDX = int(idx[1])
                 action = (axIDX - 1, ayIDX - 1)
@@ -978,7 +2263,7 @@ class Track:
                 qSlice = qVals[trackID, vxIDX, vyIDX]
                 qMax = np.max(qSlice)
                 bestIndex = np.argwhere(qSlice == qMax)
-                idx = random.choice(bestIndex)
+                idx = bestIndex[int(nextUniform() * len(bestIndex))]
                 axIDX = int(idx[0])
                 ayIDX = int(idx[1])
                 action = (axIDX - 1, ayIDX - 1)
@@ -1002,6 +2287,221 @@ class Track:
     # ************************** END SARSA METHODS *******************************
 
 
+    # ************************** FLAT LEARNING KERNEL METHODS *******************************
+    # ------------------------ TRAIN Q TABLE ---------------------------------
+    def trainQTable(self, qTable, sarsa = False, episodeNumber = 20000, maxSteps = 10000, learningRate = 0.1, discount = 0.95,
+                    randomStart = 0.3, randomMin = 0.01, randomDecay = 0.995, randomStream = None, episodes = None,
+                    replay = None, batchSize = 256, replayEvery = 64):
+        # the doQLearning (or with sarsa, doSARSA) training loop on flat states: qTable is a contiguous float64
+        # (states, 9) array, row trackID * 121 + (vx + 5) * 11 + (vy + 5), column (ax + 1) * 3 + (ay + 1), updated
+        # in place. Same rules as the loop version: goal zone starts for the first half of the episodes, epsilon-greedy
+        # actions with random tie-breaks, 0.2 acceleration failure, 1000 for reaching the finish line and -1 per move
+        # otherwise, epsilon decay after every episode. A step is a few lookups in nextStateTable / finishStates instead
+        # of moving the car, and the table, Q values and random numbers are read as plain python numbers.
+        # random numbers come from randomStream (default: an unseeded RandomStream). episodes picks which episode
+        # numbers of the episodeNumber run to train (default: all of them); goal zone starts and epsilon follow the full
+        # run's schedule, so a run can be split between workers.
+        # With a ReplayBuffer as replay (Q-learning only), moves are stored in it instead of updating qTable right
+        # away, and every replayEvery steps a minibatch of batchSize stored moves is applied at once (replayQTable).
+        if sarsa and (replay is not None):
+            raise ValueError("replay needs an off-policy update, SARSA learns from the moves it is making")
+        if (qTable.dtype != np.float64) or not qTable.flags['C_CONTIGUOUS']:
+            raise ValueError("trainQTable needs a contiguous float64 (states, 9) array")
+        if self.nextStateTable is None:
+            self.compileTransitions()
+        q = memoryview(qTable.reshape(-1)) # python floats on read, no numpy scalars
+        nextStates = memoryview(np.ascontiguousarray(self.nextStateTable, dtype = self.stateDtype).reshape(-1))
+        finishes = memoryview(np.ascontiguousarray(self.finishStates).reshape(-1))
+        nextUniform = (randomStream if randomStream is not None else RandomStream()).uniform
+
+        def chooseAction(state, eps):
+            if nextUniform() < eps:
+                return int(nextUniform() * 9) # random action
+            # greedy action, ties broken at random. Read as a copy: with doHogwildLearning other processes may change the
+            # shared row between the max and the comparison
+            row = q[state * 9:state * 9 + 9].tolist()
+            qMax = max(row)
+            bestIndex = [action for action in range(9) if row[action] == qMax]
+            return bestIndex[int(nextUniform() * len(bestIndex))]
+
+        finish_row, goal_zone_ids = self.getFinishInfo()
+        # exploration rate of every episode: reduced after each ep
+        epsSchedule = []
+        eps = randomStart
+        for ep in range(episodeNumber):
+            epsSchedule.append(eps)
+            if eps > randomMin:
+                eps *= randomDecay
+        steps = 0
+        for ep in (range(episodeNumber) if episodes is None else episodes):
+            eps = epsSchedule[ep]
+            # goal based exploring starts for the first half, then uniform over no wall states
+            if goal_zone_ids and (ep < int(0.5 * episodeNumber)) and (nextUniform() < 0.7):
+                startID = goal_zone_ids[int(nextUniform() * len(goal_zone_ids))]
+            else:
+                startID = int(nextUniform() * self.trackSize)
+            state = startID * 121 + 60 # at rest
+
+            if sarsa:
+                action = chooseAction(state, eps)
+            for _step in range(maxSteps):
+                if not sarsa:
+                    action = chooseAction(state, eps)
+                row = state * 9 + action
+                # 20 percent chance the acceleration fails: the move of acceleration (0, 0)
+                outcome = state * 9 + 4 if nextUniform() < FAIL_PROBABILITY else row
+                nextState = nextStates[outcome]
+                steps += 1
+                if replay is not None:
+                    done = finishes[outcome]
+                    replay.add((state, action, 1000.0 if done else -1.0, nextState, done))
+                    if steps % replayEvery == 0:
+                        self.replayQTable(qTable, replay, batchSize, learningRate, discount)
+                    if done:
+                        break
+                    state = nextState
+                    continue
+                qOld = q[row]
+                if finishes[outcome]:
+                    q[row] = qOld + learningRate * (1000.0 - qOld)
+                    break
+                if sarsa:
+                    nextAction = chooseAction(nextState, eps)
+                    qNext = q[nextState * 9 + nextAction]
+                else:
+                    qNext = max(q[nextState * 9:nextState * 9 + 9])
+                q[row] = qOld + learningRate * (-1.0 + discount * qNext - qOld)
+                state = nextState
+                if sarsa:
+                    action = nextAction
+        self.opCount += steps
+        return
+
+    # ------------------------ END TRAIN Q TABLE ---------------------------------
+
+    # ------------------------ EVALUATE Q TABLE ---------------------------------
+    def evaluateQTable(self, qTable, maxSteps = 500, randomStream = None):
+        # greedy run (no acceleration failures, random tie-breaks) from every starting cell, like the evaluation at the
+        # end of doQLearning / doSARSA: the shortest one that finishes becomes bestPath / bestMoves. If none finishes,
+        # the run from the first starting cell is kept. Tie-breaks draw from randomStream.
+        if self.nextStateTable is None:
+            self.compileTransitions()
+        nextUniform = (randomStream if randomStream is not None else RandomStream()).uniform
+
+        def greedyRun(start):
+            state = int(self.trackIndex[start]) * 121 + 60
+            path = [[start[0], start[1]]]
+            for _step in range(maxSteps):
+                row = qTable[state]
+                bestIndex = np.flatnonzero(row == row.max())
+                outcome = state * 9 + int(bestIndex[int(nextUniform() * len(bestIndex))])
+                state = int(self.nextStateTable.flat[outcome])
+                cell = self.trackCoords[state // 121]
+                path.append([int(cell[0]), int(cell[1])])
+                if self.finishStates.flat[outcome]:
+                    return path, True
+            return path, False
+
+        bestPath = None
+        for start in self.startingCells:
+            path, finished = greedyRun(start)
+            if finished and ((bestPath is None) or (len(path) < len(bestPath))):
+                bestPath = path
+        if bestPath is None:
+            bestPath, finished = greedyRun(self.startingCells[0])
+        self.bestPath = bestPath
+        self.bestMoves = len(bestPath) - 1
+        return
+    # ------------------------ END EVALUATE Q TABLE ---------------------------------
+
+    # ------------------------ DO PARALLEL LEARNING ---------------------------------
+    def doParallelLearning(self, sarsa = False, learners = 4, seed = None, workers = None, combine = 'best'):
+        # runs learners independent flat-kernel Q-learning (or with sarsa, SARSA) learners in a ProcessPoolExecutor
+        # of workers processes (default: every core), seeded from seed through numpy SeedSequence spawning.
+        # combine 'best' keeps the learner whose greedy evaluation finishes in the fewest moves, 'average' evaluates
+        # the mean of all Q tables instead. Averaging tables that learned different routes can give a greedy policy that
+        # never reaches 'F', in which case the best learner is kept after all. The kept table becomes self.qVals, its
+        # path bestPath / bestMoves. Any other combine raises ValueError.
+        if combine not in ('best', 'average'):
+            raise ValueError("unknown combine " + repr(combine) + ", expected 'best' or 'average'")
+        if self.nextStateTable is None:
+            self.compileTransitions() # once, before the workers get a copy of the track
+        if workers is None:
+            workers = os.cpu_count() or 1
+        seeds = np.random.SeedSequence(seed).spawn(learners + 1) # the last one is for evaluating the average
+        with ProcessPoolExecutor(max_workers = min(workers, learners), initializer = attachLearnerTrack,
+                                 initargs = (self,)) as executor:
+            results = list(executor.map(trainLearner, [sarsa] * learners, seeds[:learners]))
+        self.opCount += sum(result[3] for result in results)
+        print("learner moves: " + str([result[2] for result in results]))
+
+        if (combine == 'average'):
+            self.qVals = np.mean([result[0] for result in results], axis = 0)
+            self.evaluateQTable(self.qVals, randomStream = RandomStream(seeds[learners]))
+            if (self.track[self.bestPath[-1][0], self.bestPath[-1][1]] == 2):
+                return
+            print("the averaged Q table does not reach the finish line, keeping the best learner")
+        # learners whose path ends on the finish line come first
+        finished = [result for result in results if self.track[result[1][-1][0], result[1][-1][1]] == 2]
+        best = min(finished or results, key = lambda result: result[2])
+        self.qVals, self.bestPath, self.bestMoves = best[0], best[1], best[2]
+        return
+    # ------------------------ END DO PARALLEL LEARNING ---------------------------------
+
+    def replayQTable(self, qTable, replay, batchSize = 256, learningRate = 0.1, discount = 0.95):
+        # one minibatch of stored moves applied to qTable in one pass: every TD error is taken from the Q values before
+        # the batch, and a row drawn more than once moves by the mean of its updates (summed with np.add.at), so
+        # repeats in a small buffer do not multiply the learning rate. Prioritized buffers get the new TD errors as
+        # priorities and scale updates by their importance weights.
+        slots, weights = replay.sample(batchSize)
+        rows = replay.states[slots] * 9 + replay.actions[slots]
+        qFlat = qTable.reshape(-1)
+        # finishing moves are worth their reward alone, the rest also the discounted best next value
+        targets = replay.rewards[slots] + discount * qTable[replay.nextStates[slots]].max(axis = 1) * ~replay.dones[slots]
+        tdErrors = targets - qFlat[rows]
+        uniqueRows, inverse = np.unique(rows, return_inverse = True)
+        updates = np.zeros(uniqueRows.size)
+        np.add.at(updates, inverse, weights * tdErrors)
+        qFlat[uniqueRows] += learningRate * updates / np.bincount(inverse)
+        if replay.prioritized:
+            replay.updatePriorities(slots, tdErrors)
+        self.opCount += batchSize
+        return
+
+    # ------------------------ DO HOGWILD LEARNING ---------------------------------
+    def doHogwildLearning(self, sarsa = False, workers = None, seed = None, episodeNumber = 20000):
+        # Q-learning (or with sarsa, SARSA) with the episodeNumber episodes shared out between workers processes
+        # (default: every core), which all train one Q table in shared memory at the same time (trainQTable), without
+        # locks. Episodes are dealt round robin so every worker follows the same epsilon schedule, and each worker
+        # has its own stream seeded from seed. The result is self.qVals, evaluated into bestPath / bestMoves.
+        if self.nextStateTable is None:
+            self.compileTransitions() # once, before the workers get a copy of the track
+        if workers is None:
+            workers = os.cpu_count() or 1
+        seeds = np.random.SeedSequence(seed).spawn(workers + 1) # the last one is for the evaluation
+        shape = (self.trackSize * 121, 9)
+        block = shared_memory.SharedMemory(create = True, size = int(np.prod(shape)) * 8)
+        try:
+            qVals = np.ndarray(shape, dtype = np.float64, buffer = block.buf)
+            qVals[:] = 0.0
+            specs = {'qVals': (block.name, shape, np.float64)}
+            with ProcessPoolExecutor(max_workers = workers, initializer = attachLearnerTrack, initargs = (self, specs)) as executor:
+                steps = list(executor.map(trainHogwildShard, [sarsa] * workers, seeds[:workers],
+                                          [range(worker, episodeNumber, workers) for worker in range(workers)],
+                                          [episodeNumber] * workers))
+            self.qVals = qVals.copy()
+            del qVals # the block can only be closed once no array uses it
+        finally:
+            block.close()
+            block.unlink()
+        self.opCount += sum(steps)
+        self.evaluateQTable(self.qVals, randomStream = RandomStream(seeds[workers]))
+        return
+    # ------------------------ END DO HOGWILD LEARNING ---------------------------------
+
+    # ************************** END FLAT LEARNING KERNEL METHODS *******************************
+
+
 
 
 
@@ -0,0 +1,74 @@
+import numpy as np
+from Track import FAIL_PROBABILITY
+
+class TrackBatch:
+    # ---------------- INSTANTIATION ------------------
+    def __init__(self, track, seed = None):
+        # runs many cars on one Track at once, every rule (0.2 acceleration failure, velocity bounds, substep collision
+        # checks, NRST / STRT crash handling, finish detection) applied to all cars with array operations.
+        # Same moves as Track.updateVelocity / Track.updatePosition (through the compiled tables), one car per row.
+        self.track = track # Track whose grid, crash mode, starting cells and wallDistance are used
+        self.rng = np.random.default_rng(seed) # draws start cells and acceleration failures
+        self.failProbability = FAIL_PROBABILITY # chance an attempted acceleration is replaced by (0, 0)
+
+        self.positions = np.zeros((0, 2), dtype = int) # [row, column] of every car
+        self.velocities = np.zeros((0, 2), dtype = int) # [x, y] velocity of every car, both between -5 and 5
+        self.crashed = np.zeros(0, dtype = bool) # True for cars that hit a wall on the last step
+        self.done = np.zeros(0, dtype = bool) # True for cars that reached the finish line, they no longer move
+        self.moves = np.zeros(0, dtype = int) # steps taken by every car until it finished
+        self.numberOfCrashes = np.zeros(0, dtype = int) # crashes of every car
+    # ---------------- END INSTANTIATION ------------------
+
+    # ---------------- GETTER METHODS ------------------
+    def getStateIndex(self):
+        # flat state (trackID * 121 + (vx + 5) * 11 + (vy + 5)) of every car, the row of Track.nextStateTable / qTable
+        trackIDs = self.track.trackIndex[self.positions[:, 0], self.positions[:, 1]].astype(int)
+        return trackIDs * 121 + (self.velocities[:, 0] + 5) * 11 + (self.velocities[:, 1] + 5)
+    # ---------------- END GETTER METHODS ------------------
+
+    # ---------------- ACTION METHODS ------------------
+    def reset(self, n, trackIDs = None):
+        # n cars at rest on starting cells picked uniformly at random, or on the cells of the given trackIDs
+        if trackIDs is None:
+            startingCells = np.array(self.track.startingCells, dtype = int)
+            self.positions = startingCells[self.rng.integers(len(startingCells), size = n)]
+        else:
+            self.positions = self.track.trackCoords[np.asarray(trackIDs, dtype = int)].copy()
+            n = self.positions.shape[0]
+        self.velocities = np.zeros((n, 2), dtype = int)
+        self.crashed = np.zeros(n, dtype = bool)
+        self.done = np.zeros(n, dtype = bool)
+        self.moves = np.zeros(n, dtype = int)
+        self.numberOfCrashes = np.zeros(n, dtype = int)
+        return self.getStateIndex()
+
+    def step(self, actions):
+        # one move for every car that has not finished. actions holds an action index ((ax + 1) * 3 + (ay + 1)) per car.
+        # Returns the new flat states, and this step's crash and finish flags.
+        # Moves are looked up in the Track's compiled nextStateTable / finishStates, so the collision rules are the
+        # ones of Track.traceVelocity. A move crashed when the car does not keep its new velocity (crashes stop it,
+        # finishing keeps it, and a car with new velocity (0, 0) cannot hit anything).
+        if self.track.nextStateTable is None:
+            self.track.compileTransitions()
+        actions = np.asarray(actions, dtype = int).copy()
+        active = ~self.done
+        # 20% chance the acceleration fails: the move of acceleration (0, 0), action index 4
+        actions[self.rng.random(actions.shape[0]) < self.failProbability] = 4
+        cars = np.flatnonzero(active)
+        states = self.getStateIndex()[cars]
+        nextStates = np.asarray(self.track.nextStateTable[states, actions[cars]]).astype(int)
+        finishes = np.asarray(self.track.finishStates[states, actions[cars]])
+
+        newVelocities = np.clip(self.velocities[cars] + np.stack((actions[cars] // 3 - 1, actions[cars] % 3 - 1), axis = 1), -5, 5)
+        self.positions[cars] = self.track.trackCoords[nextStates // 121]
+        self.velocities[cars] = np.stack(((nextStates % 121) // 11 - 5, nextStates % 11 - 5), axis = 1)
+        crashed = np.zeros(actions.shape[0], dtype = bool)
+        crashed[cars] = (self.velocities[cars] != newVelocities).any(axis = 1)
+        finished = np.zeros(actions.shape[0], dtype = bool)
+        finished[cars] = finishes
+        self.crashed = crashed
+        self.done |= finished
+        self.moves += active
+        self.numberOfCrashes += crashed
+        return self.getStateIndex(), crashed, finished
+    # ---------------- END ACTION METHODS ------------------
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from Track import Track
+
+def walledOffTrack(crashReset):
+    # the finish line is behind a wall, so no state reachable from the start can finish
+    rows = ["########",
+            "#S...#F#",
+            "#....#F#",
+            "########"]
+    text = np.array([list(row) for row in rows])
+    codes = np.select([text == 'S', text == 'F', text == '#'], [1, 2, 3], 0)
+    return Track(codes, crashReset, text)
+
+@pytest.mark.parametrize("crashReset", [False, True])
+@pytest.mark.parametrize("backup", ['sparse', 'gaussSeidel', 'prioritized', 'parallel'])
+def test_pruned_solve_with_unreachable_finish(crashReset, backup):
+    # pruning keeps nothing here: the solve falls back to every state and reports no path, like the unpruned one
+    track = walledOffTrack(crashReset)
+    track.doValueIteration(backup, 1e-6, prune = True, workers = 2)
+    assert track.activeStates is None
+    assert track.getSweepCount() > 0
+    path = track.getBestPath()
+    assert track.track[path[-1][0], path[-1][1]] != 2
+
+    unpruned = walledOffTrack(crashReset)
+    unpruned.doValueIteration(backup, 1e-6, workers = 2)
+    assert track.getBestMoves() == unpruned.getBestMoves()